@@ -0,0 +1,297 @@
+"""
+Memory used by the gateway cache for a synthetic guild under each cache profile.
+
+Feeds a guild, as delivered on startup for the bot's intents, plus the bot's
+own messages into hikari's cache and reports the memory the cache holds on to.
+Every profile is measured in a fresh interpreter.
+
+Run from the repository root (like the bot, it needs a `config.yaml`):
+
+    python -m benchmarks.cache_memory --members 10000
+"""
+
+import argparse
+import datetime as dt
+import gc
+import json
+import subprocess
+import sys
+import tracemalloc
+
+from hikari.impl.cache import CacheImpl
+from hikari.impl.config import CacheSettings
+from hikari.impl.entity_factory import EntityFactoryImpl
+
+from bot.__main__ import cache_components
+from bot.config import CACHE_PROFILES
+
+
+GUILD_ID = 1_000_000
+BOT_ID = 2_000_000
+TIMESTAMP = dt.datetime(2023, 1, 1, tzinfo=dt.timezone.utc).isoformat()
+
+
+def user_payload(user_id: int) -> dict:
+    return {
+        'id': str(user_id),
+        'username': f'Member{user_id}',
+        'discriminator': f'{user_id % 10000:04d}',
+        'avatar': 'a' * 32,
+        'bot': user_id == BOT_ID,
+        'system': False,
+        'public_flags': 0,
+    }
+
+
+def member_payload(user_id: int, role_ids: list[int]) -> dict:
+    return {
+        'user': user_payload(user_id),
+        'roles': [ str(r) for r in role_ids ],
+        'nick': None,
+        'avatar': None,
+        'joined_at': TIMESTAMP,
+        'premium_since': None,
+        'deaf': False,
+        'mute': False,
+        'pending': False,
+        'communication_disabled_until': None,
+    }
+
+
+def guild_payload(members: int, roles: int, channels: int, emojis: int, stickers: int) -> dict:
+    role_ids = [ GUILD_ID + 1 + i for i in range(roles) ]
+
+    return {
+        'id': str(GUILD_ID),
+        'name': 'Synthetic guild',
+        'icon': None,
+        'splash': None,
+        'discovery_splash': None,
+        'banner': None,
+        'owner_id': str(BOT_ID + 1),
+        'afk_channel_id': None,
+        'afk_timeout': 300,
+        'verification_level': 1,
+        'default_message_notifications': 1,
+        'explicit_content_filter': 2,
+        'features': ['COMMUNITY'],
+        'mfa_level': 0,
+        'application_id': None,
+        'widget_enabled': False,
+        'widget_channel_id': None,
+        'system_channel_id': None,
+        'system_channel_flags': 0,
+        'rules_channel_id': None,
+        'max_presences': None,
+        'max_members': 500000,
+        'max_video_channel_users': 25,
+        'vanity_url_code': None,
+        'description': None,
+        'premium_tier': 0,
+        'premium_subscription_count': 0,
+        'preferred_locale': 'en-US',
+        'public_updates_channel_id': None,
+        'nsfw_level': 0,
+        'premium_progress_bar_enabled': False,
+        'joined_at': TIMESTAMP,
+        'large': True,
+        'unavailable': False,
+        'member_count': members,
+        'roles': [
+            {
+                'id': str(GUILD_ID),
+                'name': '@everyone',
+                'color': 0,
+                'hoist': False,
+                'icon': None,
+                'unicode_emoji': None,
+                'position': 0,
+                'permissions': '1071698660929',
+                'managed': False,
+                'mentionable': False,
+            }
+        ] + [
+            {
+                'id': str(role_id),
+                'name': f'Role {role_id}',
+                'color': role_id % 0xffffff,
+                'hoist': False,
+                'icon': None,
+                'unicode_emoji': None,
+                'position': i + 1,
+                'permissions': '0',
+                'managed': False,
+                'mentionable': True,
+            }
+            for i, role_id in enumerate(role_ids)
+        ],
+        'channels': [
+            {
+                'id': str(GUILD_ID + 100_000 + i),
+                'type': 0,
+                'name': f'channel-{i}',
+                'position': i,
+                'permission_overwrites': [],
+                'topic': 'Topic ' * 10,
+                'nsfw': False,
+                'last_message_id': None,
+                'rate_limit_per_user': 0,
+                'parent_id': None,
+                'last_pin_timestamp': None,
+            }
+            for i in range(channels)
+        ],
+        'threads': [],
+        'emojis': [
+            {
+                'id': str(GUILD_ID + 200_000 + i),
+                'name': f'emoji_{i}',
+                'roles': [],
+                'require_colons': True,
+                'managed': False,
+                'animated': False,
+                'available': True,
+            }
+            for i in range(emojis)
+        ],
+        'stickers': [
+            {
+                'id': str(GUILD_ID + 300_000 + i),
+                'name': f'sticker_{i}',
+                'description': 'Sticker',
+                'tags': 'sticker',
+                'type': 2,
+                'format_type': 1,
+                'available': True,
+                'guild_id': str(GUILD_ID),
+            }
+            for i in range(stickers)
+        ],
+        # A few members have a role, like the event roles in a real guild.
+        'members': [ member_payload(BOT_ID + 1 + i, role_ids[i % len(role_ids):][:1] if i % 10 == 0 and role_ids else [])
+                     for i in range(members) ],
+        'presences': [],
+        'voice_states': [],
+        'stage_instances': [],
+        'guild_scheduled_events': [],
+    }
+
+
+def message_payload(message_id: int, channel_id: int) -> dict:
+    # Roughly what the server board and roster messages look like.
+    return {
+        'id': str(message_id),
+        'channel_id': str(channel_id),
+        'guild_id': str(GUILD_ID),
+        'author': user_payload(BOT_ID),
+        'content': '',
+        'timestamp': TIMESTAMP,
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': [
+            {
+                'title': 'SERVER BROWSER',
+                'description': 'Updated <t:1672531200:R>',
+                'fields': [ { 'name': f'Server {i}', 'value': 'Players `0 / 64`\nMap `Foy`', 'inline': False } for i in range(10) ],
+            }
+        ],
+        'pinned': False,
+        'type': 0,
+        'flags': 0,
+    }
+
+
+def measure(profile: str, args: argparse.Namespace) -> dict:
+    """Fills a cache with the synthetic guild and returns how much memory it holds on to."""
+    app = _App()
+    entity_factory = EntityFactoryImpl(app)
+    payload = guild_payload(args.members, args.roles, args.channels, args.emojis, args.stickers)
+    messages = [ message_payload(GUILD_ID + 400_000 + i, GUILD_ID + 100_000) for i in range(args.messages) ]
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    cache = CacheImpl(app, CacheSettings(components=cache_components(profile)))
+    guild = entity_factory.deserialize_gateway_guild(payload, user_id=BOT_ID)
+
+    cache.set_guild(guild.guild())
+    for channel in guild.channels().values():
+        cache.set_guild_channel(channel)
+    for role in guild.roles().values():
+        cache.set_role(role)
+    for emoji in guild.emojis().values():
+        cache.set_emoji(emoji)
+    for sticker in guild.stickers().values():
+        cache.set_sticker(sticker)
+    for member in guild.members().values():
+        cache.set_member(member)
+    for data in messages:
+        cache.set_message(entity_factory.deserialize_message(data))
+
+    # Drop everything that isn't referenced by the cache.
+    payload = messages = data = guild = None
+    gc.collect()
+
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'profile': profile,
+        'components': str(cache_components(profile)),
+        'cache_bytes': after - before,
+        'rss_bytes': _rss(),
+        'cached_members': len(cache.get_members_view_for_guild(GUILD_ID)),
+    }
+
+
+class _App():
+    """Stands in for the bot; entities only keep a reference to it."""
+
+
+def _rss() -> int:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--roles', type=int, default=50)
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--emojis', type=int, default=200)
+    parser.add_argument('--stickers', type=int, default=30)
+    parser.add_argument('--messages', type=int, default=300, help='messages sent by the bot')
+    parser.add_argument('--profile', choices=CACHE_PROFILES, help='measure one profile in this process')
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(measure(args.profile, args)))
+        return
+
+    print(f'{args.members} members, {args.roles} roles, {args.channels} channels, '
+          f'{args.emojis} emojis, {args.stickers} stickers, {args.messages} messages\n')
+    print(f'{"profile":<10} {"cache":>12} {"rss":>12} {"members":>10}')
+
+    for profile in CACHE_PROFILES:
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.cache_memory', '--profile', profile, *sys.argv[1:]],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        print(f'{profile:<10} {result["cache_bytes"] / 2**20:>10.1f}MB {result["rss_bytes"] / 2**20:>10.1f}MB '
+              f'{result["cached_members"]:>10}')
+
+
+if __name__ == '__main__':
+    main()
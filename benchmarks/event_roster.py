@@ -0,0 +1,120 @@
+"""
+Latency of the `/event` command for synthetic guilds of different sizes.
+
+Indexes the event roles of a synthetic guild and invokes the `/event` command
+callback against a fake Discord. Every invocation follows a member enlisting,
+so the roster has to be rendered again, and is repeated right away to measure
+the cached roster as well. Responses go through the outbound scheduler like
+in the bot, keep the invocations below its interaction rate limit (50/s) to
+leave its pacing out of the results.
+
+Run from the repository root (the `bot` package needs a `config.yaml`):
+
+    python -m benchmarks.event_roster --members 1000 10000 100000
+"""
+
+import argparse
+import asyncio
+import time
+
+from hikari.impl.entity_factory import EntityFactoryImpl
+
+from benchmarks.cache_memory import member_payload
+from benchmarks.fakes import FakeBot, FakeContext, FakeRest, percentile
+from bot.config import EventSettings
+from bot.extensions import events
+from bot.utils.outbound import OutboundScheduler
+
+
+GUILD_ID = 1_000_000
+AXIS_ROLE = GUILD_ID + 1
+ALLIED_ROLE = GUILD_ID + 2
+SL_ROLE = GUILD_ID + 3
+MEMBER_ID = 10_000_000
+
+
+def member_roles(idx: int, enlisted: float) -> list[int]:
+    """Event roles of the `idx`th member: `enlisted` of the members are on a team, every tenth of them an SL."""
+    if idx % 1000 >= enlisted * 1000:
+        return []
+
+    roles = [AXIS_ROLE if idx % 2 else ALLIED_ROLE]
+
+    if idx % 20 < 2:
+        roles.append(SL_ROLE)
+
+    return roles
+
+
+async def measure(size: int, args: argparse.Namespace, bot: FakeBot) -> None:
+    bot.d.outbound = OutboundScheduler()
+    entity_factory = EntityFactoryImpl(bot)
+    members = [ entity_factory.deserialize_member(member_payload(MEMBER_ID + i, member_roles(i, args.enlisted)), guild_id=GUILD_ID)
+                for i in range(size) ]
+
+    start = time.perf_counter()
+    roster = events.Roster(GUILD_ID, EventSettings(AXIS_ROLE, ALLIED_ROLE, SL_ROLE))
+    roster.index.build(members)
+    build_time = time.perf_counter() - start
+
+    roster.events = events.ScheduledEventCache(GUILD_ID)
+    roster.events.build([])
+    events._rosters[GUILD_ID] = roster
+
+    ctx = FakeContext(bot, GUILD_ID, 'event')
+    callback = events.event.callback
+    rendered: list[float] = []
+    cached: list[float] = []
+
+    for i in range(args.invocations):
+        joining = entity_factory.deserialize_member(member_payload(MEMBER_ID + size + i, [AXIS_ROLE]), guild_id=GUILD_ID)
+        roster.index.update_member(joining)
+
+        start = time.perf_counter()
+        await callback(ctx)
+        rendered.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await callback(ctx)
+        cached.append(time.perf_counter() - start)
+
+    events._rosters.pop(GUILD_ID, None)
+    await bot.d.outbound.close()
+
+    enlisted = len(roster.index.names)
+    pages = len(roster.render())
+
+    print(f'{size:>10} {enlisted:>9} {pages:>6} {build_time * 1000:>10.1f}ms '
+          f'{percentile(rendered, 50) * 1000:>8.2f}ms {percentile(rendered, 99) * 1000:>8.2f}ms '
+          f'{percentile(cached, 50) * 1000:>8.2f}ms {percentile(cached, 99) * 1000:>8.2f}ms')
+
+
+async def run(args: argparse.Namespace) -> None:
+    rest = FakeRest(args.rest_latency)
+    bot = FakeBot(rest)
+
+    # Roster navigation buttons are built through the plugin's bot.
+    events.plugin.app = bot
+
+    print(f'{args.enlisted:.0%} of the members enlisted, {args.invocations} invocations, '
+          f'REST latency {args.rest_latency * 1000:.0f}ms\n')
+    print(f'{"members":>10} {"enlisted":>9} {"pages":>6} {"index":>12} '
+          f'{"render p50":>10} {"p99":>10} {"cached p50":>10} {"p99":>10}')
+
+    for size in args.members:
+        await measure(size, args, bot)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--members', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--enlisted', type=float, default=0.05, help='share of the members with a team role')
+    parser.add_argument('--invocations', type=int, default=20)
+    parser.add_argument('--rest-latency', type=float, default=0.0, help='latency of Discord REST calls (in seconds)')
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Stand-ins for the outside world, so the benchmarks run without network access.
+
+- Fake game servers answer the UT2004 query protocol on local UDP ports with
+  configurable latency, loss and player list size.
+- A fake Discord bot records the REST calls and gateway updates the bot makes
+  and answers them after a configurable latency.
+
+The fake game servers can also run in a separate process, so they don't
+compete with the code being measured for its event loop:
+
+    python -m benchmarks.fakes --servers 100 --latency 0.02 --loss 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Sequence
+
+import hikari
+from hikari.impl.special_endpoints import MessageActionRowBuilder
+
+from bot.utils.unreal_query import HEADER, QueryType
+
+
+MAX_DATAGRAM = 1400
+BOT_ID = 2_000_000
+
+
+# GAME SERVERS
+
+def _string(text: str) -> bytes:
+    data = text.encode('latin-1')[:126] + b'\x00'
+    return bytes([len(data)]) + data
+
+
+class FakeGameServer(asyncio.DatagramProtocol):
+    """
+    Answers info and player queries like a UT2004 server.
+
+    Every reply datagram is delayed by `latency` plus up to `jitter` seconds and
+    dropped with probability `loss`. Every info query changes the player
+    count by one with probability `churn`.
+    """
+
+    def __init__(self,
+                 name: str,
+                 players: int,
+                 max_players: int = 64,
+                 name_length: int = 16,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 loss: float = 0.0,
+                 churn: float = 0.0) -> None:
+        self.name = name
+        self.players = players
+        self.max_players = max_players
+        self.name_length = name_length
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.churn = churn
+        self.transport: asyncio.DatagramTransport | None = None
+        self.queries: int = 0
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def info(self) -> bytes:
+        host, port = self.transport.get_extra_info('sockname')[:2]
+        return (HEADER + bytes([QueryType.INFO])
+                + struct.pack('<i', 1) + _string(host) + struct.pack('<ii', port - 1, port)
+                + _string(self.name) + _string('DH-Foy_Advance') + _string('DH_OnslaughtGame')
+                + struct.pack('<ii', self.players, self.max_players))
+
+    def player_list(self) -> list[bytes]:
+        datagrams: list[bytes] = []
+        data = bytearray()
+
+        for i in range(self.players):
+            player = struct.pack('<i', i) + _string(f'{i:04d}'.ljust(self.name_length, 'x')) + struct.pack('<iii', 50, i, 0)
+
+            if data and len(data) + len(player) > MAX_DATAGRAM:
+                datagrams.append(bytes(data))
+                data = bytearray()
+
+            if not data:
+                data += HEADER + bytes([QueryType.PLAYERS])
+
+            data += player
+
+        return datagrams + [bytes(data)] if data else datagrams
+
+    def _send(self, data: bytes, addr: tuple[str, int]) -> None:
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        if len(data) < len(HEADER) + 1:
+            return
+
+        query_type = data[len(HEADER)]
+
+        if query_type == QueryType.INFO:
+            self.queries += 1
+
+            if random.random() < self.churn:
+                self.players = max(0, min(self.max_players, self.players + random.choice((-1, 1))))
+
+            replies = [self.info()]
+        elif query_type == QueryType.PLAYERS:
+            replies = self.player_list()
+        else:
+            return
+
+        loop = asyncio.get_running_loop()
+
+        for reply in replies:
+            if random.random() < self.loss:
+                continue
+
+            delay = self.latency + random.uniform(0, self.jitter)
+
+            if delay > 0:
+                loop.call_later(delay, self._send, reply, addr)
+            else:
+                self._send(reply, addr)
+
+
+async def start_game_servers(count: int, players: int = 32, **kwargs: Any) -> list[FakeGameServer]:
+    """Starts `count` fake game servers on local ports, see `FakeGameServer` for the options."""
+    loop = asyncio.get_running_loop()
+    servers: list[FakeGameServer] = []
+
+    for i in range(count):
+        _, server = await loop.create_datagram_endpoint(lambda i=i: FakeGameServer(f'Fake Server #{i + 1}', players, **kwargs),
+                                                        local_addr=('127.0.0.1', 0))
+        servers.append(server)
+
+    return servers
+
+
+def server_addresses(servers: Sequence[FakeGameServer]) -> list[tuple[str, int]]:
+    return [ s.transport.get_extra_info('sockname')[:2] for s in servers ]
+
+
+class GameServerProcess():
+    """Fake game servers running in a child process (see the module's `main`)."""
+
+    def __init__(self, args: Sequence[str]) -> None:
+        self.args = list(args)
+        self.process: asyncio.subprocess.Process | None = None
+        self.addresses: list[tuple[str, int]] = []
+
+    async def __aenter__(self) -> 'GameServerProcess':
+        self.process = await asyncio.create_subprocess_exec(sys.executable, '-m', 'benchmarks.fakes', *self.args,
+                                                            stdin=asyncio.subprocess.PIPE,
+                                                            stdout=asyncio.subprocess.PIPE)
+        line = await self.process.stdout.readline()
+        self.addresses = [ (host, port) for host, port in json.loads(line) ]
+
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        # The servers shut down once their stdin is closed.
+        self.process.stdin.close()
+        await self.process.wait()
+
+
+def add_game_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--servers', type=int, default=50, help='number of fake game servers')
+    parser.add_argument('--players', type=int, default=32, help='players on each server')
+    parser.add_argument('--name-length', type=int, default=16, help='length of player names')
+    parser.add_argument('--latency', type=float, default=0.02, help='reply latency (in seconds)')
+    parser.add_argument('--jitter', type=float, default=0.01, help='random extra reply latency (in seconds)')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of a reply datagram getting lost')
+    parser.add_argument('--churn', type=float, default=0.2, help='probability of the player count changing on a query')
+
+
+def game_server_arguments(args: argparse.Namespace) -> list[str]:
+    return ['--servers', str(args.servers),
+            '--players', str(args.players),
+            '--name-length', str(args.name_length),
+            '--latency', str(args.latency),
+            '--jitter', str(args.jitter),
+            '--loss', str(args.loss),
+            '--churn', str(args.churn)]
+
+
+# DISCORD
+
+class FakeMessage():
+    def __init__(self, message_id: int, channel_id: int, embeds: Sequence[hikari.Embed]) -> None:
+        self.id = message_id
+        self.channel_id = channel_id
+        self.author = SimpleNamespace(id=BOT_ID)
+        self.embeds = list(embeds)
+
+
+class FakeRest():
+    """Records REST calls by endpoint and answers them after `latency` seconds."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.messages: dict[int, FakeMessage] = {}
+        self.next_id: int = 3_000_000
+
+    async def _call(self, endpoint: str) -> None:
+        self.calls[endpoint] += 1
+
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def fetch_channel(self, channel: int) -> 'FakeChannel':
+        await self._call('fetch_channel')
+        return FakeChannel(self, int(channel))
+
+    async def fetch_messages(self, channel: Any) -> list[FakeMessage]:
+        await self._call('fetch_messages')
+        return sorted((m for m in self.messages.values() if m.channel_id == int(channel.id)), key=lambda m: m.id, reverse=True)
+
+    async def create_message(self, channel: Any, content: str = '', embeds: Sequence[hikari.Embed] = ()) -> FakeMessage:
+        await self._call('create_message')
+        self.next_id += 1
+        message = self.messages[self.next_id] = FakeMessage(self.next_id, int(channel.id), embeds)
+        return message
+
+    async def edit_message(self, channel: Any, message: Any, content: str = '', embeds: Sequence[hikari.Embed] = ()) -> FakeMessage:
+        await self._call('edit_message')
+        edited = self.messages.get(int(message))
+
+        if edited is None:
+            raise hikari.NotFoundError(f'/channels/{int(channel.id)}/messages/{int(message)}', {}, b'')
+
+        edited.embeds = list(embeds)
+        return edited
+
+    async def delete_message(self, channel: Any, message: Any) -> None:
+        await self._call('delete_message')
+        self.messages.pop(int(message), None)
+
+    async def edit_member(self, guild: Any, member: Any, **kwargs: Any) -> None:
+        await self._call('edit_member')
+
+    def build_message_action_row(self) -> hikari.api.MessageActionRowBuilder:
+        return MessageActionRowBuilder()
+
+
+class FakeChannel():
+    def __init__(self, rest: FakeRest, channel_id: int) -> None:
+        self.rest = rest
+        self.id = channel_id
+        self.name = f'channel-{channel_id}'
+
+    async def send(self, content: str = '', embeds: Sequence[hikari.Embed] = ()) -> FakeMessage:
+        return await self.rest.create_message(self, content, embeds)
+
+
+class FakeBot():
+    """Has what the extensions use of `lightbulb.BotApp`: REST, presence updates and `d`."""
+
+    def __init__(self, rest: FakeRest) -> None:
+        self.rest = rest
+        self.d = SimpleNamespace()
+        self.me = SimpleNamespace(id=BOT_ID)
+
+    def get_me(self) -> SimpleNamespace:
+        return self.me
+
+    async def update_presence(self, **kwargs: Any) -> None:
+        await self.rest._call('update_presence')
+
+
+class FakeContext():
+    """Command context of a slash command invoked in `guild_id`."""
+
+    def __init__(self, bot: FakeBot, guild_id: int, command: str) -> None:
+        self.bot = bot
+        self.guild_id = guild_id
+        self.command = SimpleNamespace(name=command)
+        self.responses: list[tuple[tuple, dict]] = []
+
+    async def respond(self, *args: Any, **kwargs: Any) -> None:
+        await self.bot.rest._call('interaction_response')
+        self.responses.append((args, kwargs))
+
+
+# STATS
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """Nearest-rank percentile, `p` between 0 and 100."""
+    if not values:
+        return float('nan')
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def format_latencies(values: Sequence[float]) -> str:
+    return '  '.join(f'{label} {percentile(values, p) * 1000:8.2f}ms'
+                     for label, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Runs fake game servers until stdin is closed, their addresses are printed as JSON.')
+    add_game_server_arguments(parser)
+    args = parser.parse_args()
+
+    async def serve() -> None:
+        servers = await start_game_servers(args.servers,
+                                           args.players,
+                                           name_length=args.name_length,
+                                           latency=args.latency,
+                                           jitter=args.jitter,
+                                           loss=args.loss,
+                                           churn=args.churn)
+
+        print(json.dumps(server_addresses(servers)), flush=True)
+
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        await reader.read()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
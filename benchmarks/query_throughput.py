@@ -0,0 +1,66 @@
+"""
+Throughput and latency of `unreal_query.get()` against fake game servers.
+
+Queries every fake server (info and player list, like the server browser does)
+for a number of rounds and reports the time each round took, the round trip
+times of the individual queries and how many queries went unanswered. The
+fake servers run in a separate process (see `benchmarks.fakes`).
+
+Run from the repository root (the `bot` package needs a `config.yaml`):
+
+    python -m benchmarks.query_throughput --servers 200 --loss 0.02
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.fakes import GameServerProcess, add_game_server_arguments, format_latencies, game_server_arguments
+from bot.utils import unreal_query
+
+
+async def run(args: argparse.Namespace) -> None:
+    async with GameServerProcess(game_server_arguments(args)) as game_servers:
+        addresses = game_servers.addresses
+        estimators = [ unreal_query.RttEstimator() for _ in addresses ]
+        rounds: list[float] = []
+        rtts: list[float] = []
+        answered = 0
+
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            infos = await unreal_query.get(*addresses, players=True, estimators=estimators)
+            rounds.append(time.perf_counter() - start)
+
+            answered += sum(1 for info in infos if info is not None)
+            # Only answers to the first attempt are sampled (and only in the estimators).
+            rtts.extend(e.last_rtt for e in estimators if e.last_rtt is not None)
+
+            for estimator in estimators:
+                estimator.last_rtt = None
+
+        unreal_query.close()
+
+    queries = len(addresses) * args.rounds
+    elapsed = sum(rounds)
+    retries = sum(e.losses for e in estimators)
+
+    print(f'{len(addresses)} servers, {args.players} players each, {args.rounds} rounds, '
+          f'latency {args.latency * 1000:.0f}ms (+{args.jitter * 1000:.0f}ms), loss {args.loss:.0%}\n')
+    print(f'throughput  {queries / elapsed:10.0f} queries/s')
+    print(f'answered    {answered:10d} / {queries} ({answered / queries:.1%}), {retries} timed out attempts')
+    print(f'round       {format_latencies(rounds)}')
+    print(f'query rtt   {format_latencies(rtts)}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_game_server_arguments(parser)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
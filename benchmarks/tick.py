@@ -0,0 +1,98 @@
+"""
+End-to-end server browser ticks against fake game servers and a fake Discord.
+
+Runs the steps of the server info task (poll the servers that are due, update
+the presence and the board when something has changed) and reports how long
+each tick took and how many REST calls and gateway updates it made. Updates
+go through the bot's outbound scheduler, so its pacing is part of the tick.
+
+Run from the repository root (the `bot` package needs a `config.yaml`):
+
+    python -m benchmarks.tick --servers 100 --churn 0.5 --rest-latency 0.1
+"""
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from benchmarks.fakes import (FakeBot, FakeChannel, FakeRest, GameServerProcess,
+                              add_game_server_arguments, format_latencies, game_server_arguments)
+from bot.config import Server as ServerSettings, ServerBrowserSettings
+from bot.extensions.servers import PAGES_PER_MESSAGE, update_presence_player_count, update_server_info_channel
+from bot.utils.bulletin import BulletinBoard
+from bot.utils.outbound import OutboundScheduler
+from bot.utils.server_list import Server, ServerCollection
+
+
+CHANNEL_ID = 1_000_100
+
+
+async def run(args: argparse.Namespace) -> None:
+    rest = FakeRest(args.rest_latency)
+    bot = FakeBot(rest)
+    bot.d.outbound = OutboundScheduler()
+    channel = FakeChannel(rest, CHANNEL_ID)
+    board = BulletinBoard(bot, None, 'benchmark', bot.d.outbound, PAGES_PER_MESSAGE)
+
+    async with GameServerProcess(game_server_arguments(args)) as game_servers:
+        conf = ServerBrowserSettings(servers=[ ServerSettings(f'Fake Server #{i + 1}', host, port)
+                                               for i, (host, port) in enumerate(game_servers.addresses) ],
+                                     channel=CHANNEL_ID,
+                                     query_interval=args.interval,
+                                     idle_interval=args.interval)
+        servers = ServerCollection([ Server((s.address, s.query_port), s.name) for s in conf.servers ], conf)
+
+        ticks: list[float] = []
+        calls: list[Counter[str]] = []
+        presence_players: int | None = None
+
+        for _ in range(args.ticks):
+            await servers.wait()
+
+            before = rest.calls.copy()
+            start = time.perf_counter()
+
+            changed = await servers.update()
+            total_players = servers.get_total_players()
+
+            if total_players != presence_players:
+                update_presence_player_count(bot, servers)
+                presence_players = total_players
+
+            if changed:
+                await update_server_info_channel(list(servers), board, channel)
+
+            ticks.append(time.perf_counter() - start)
+            calls.append(rest.calls - before)
+
+        await servers.close()
+        await bot.d.outbound.close()
+
+    # The first tick posts the board, the rest only edit it.
+    steady = calls[1:] or calls
+    total: Counter[str] = sum(steady, Counter())
+
+    print(f'{len(game_servers.addresses)} servers, {args.players} players each, {args.ticks} ticks every {args.interval}s, '
+          f'churn {args.churn:.0%}, REST latency {args.rest_latency * 1000:.0f}ms\n')
+    print(f'tick        {format_latencies(ticks)}')
+    print(f'first tick  {ticks[0] * 1000:8.2f}ms, {sum(calls[0].values())} REST calls')
+    print(f'REST calls per tick after the first: {sum(total.values()) / len(steady):.2f}')
+
+    for endpoint, count in sorted(total.items()):
+        print(f'    {endpoint:<20} {count / len(steady):8.2f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_game_server_arguments(parser)
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=1.0, help='query interval (in seconds)')
+    parser.add_argument('--rest-latency', type=float, default=0.05, help='latency of Discord REST calls (in seconds)')
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
 from .config import Config
+from .utils.state import StateStore
 
 __version__ = '0.1.0'
 
-config: Config = Config.load_from('./config.yaml')
\ No newline at end of file
+CONFIG_PATH = './config.yaml'
+
+config: Config = Config.load_from(CONFIG_PATH)
+state: StateStore = StateStore(config.state_dir)
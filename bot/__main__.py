@@ -1,20 +1,45 @@
 import os
 import logging
+import importlib
+from pathlib import Path
 
 import hikari
 from hikari.impl.config import CacheSettings
 from hikari.api.config import CacheComponents
 from hikari import Intents
 import lightbulb
-from lightbulb.ext import tasks
 import bot as darklight_bot
+from bot.utils.outbound import OutboundScheduler
+
+
+EXTENSIONS_DIR = './bot/extensions'
+
+
+def cache_components(profile: str) -> CacheComponents:
+    """
+    Cache components for a cache profile. The `minimal` profile caches only
+    what the extensions declare in their `CACHE_COMPONENTS`.
+    """
+    if profile == 'full':
+        return CacheComponents.ALL
+
+    components = CacheComponents.ME
+
+    for path in sorted(Path(EXTENSIONS_DIR).glob('*.py')):
+        if path.name.startswith('_'):
+            continue
+
+        extension = importlib.import_module(f'bot.extensions.{path.stem}')
+        components |= getattr(extension, 'CACHE_COMPONENTS', CacheComponents.NONE)
+
+    return components
 
 
 def create_bot() -> lightbulb.BotApp:
     with open('./secrets/token') as f:
         token = f.read().strip()
 
-    cache_settings = CacheSettings(components=CacheComponents.ALL)
+    cache_settings = CacheSettings(components=cache_components(darklight_bot.config.cache_profile))
     intents = Intents.GUILDS | Intents.GUILD_MEMBERS | Intents.GUILD_SCHEDULED_EVENTS
 
     # Create the bot instance
@@ -22,10 +47,15 @@ def create_bot() -> lightbulb.BotApp:
                            intents=intents,
                            cache_settings=cache_settings)
 
-    tasks.load(bot)
+    # Shared queue for REST and gateway updates, see `OutboundScheduler`
+    bot.d.outbound = OutboundScheduler()
+
+    @bot.listen(hikari.StoppingEvent)
+    async def on_stopping(_: hikari.StoppingEvent) -> None:
+        await bot.d.outbound.close()
 
     # Load extensions
-    bot.load_extensions_from('./bot/extensions')
+    bot.load_extensions_from(EXTENSIONS_DIR)
 
     return bot
 
@@ -3,9 +3,19 @@ from __future__ import annotations
 import yaml
 import sys
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, Self
 from dacite.core import from_dict
+from dacite.exceptions import DaciteError
+
+
+# `minimal` caches only what the loaded extensions need, `full` caches everything.
+CACHE_PROFILES = ('minimal', 'full')
+
+
+class ConfigError(Exception):
+    """Configuration file is missing or invalid"""
+    pass
 
 
 @dataclass
@@ -16,7 +26,7 @@ class Server:
     Attributes
     ----------
         name : Server name (unused).
-        address : IP address of the game server.
+        address : IP address or hostname of the game server.
         query_port : Port for the query protocol.
     """
 
@@ -35,11 +45,15 @@ class EventSettings:
         axis_role : `ID` of the `Axis` team role in the main guild.
         allied_role : `ID` of the `Allies` team role in the main guild.
         sl_role : `ID` of the squad leader role in the main guild.
+        channel : `ID` of the channel in the main guild where the roster will be posted and kept updated (optional).
+        board_delay : Time to wait for more role changes before updating the roster in `channel` (in seconds).
     """
 
     axis_role: int
     allied_role: int
     sl_role: int
+    channel: Optional[int] = None
+    board_delay: float = 5
 
 
 @dataclass
@@ -51,43 +65,158 @@ class ServerBrowserSettings:
     ----------
         servers : `List` of game servers to query.
         channel : `ID` of the dedicated channel in the main guild where server info will be posted and updated.
-        query_inteval : Interval for querying `servers` and updating info in the set `channel` (in seconds).
+        query_inteval : Interval for querying `servers` that have players and updating info in the set `channel` (in seconds).
+        idle_interval : Interval for querying empty `servers` (in seconds).
+        max_backoff : Longest interval between queries to an offline server (in seconds).
+        circuit_breaker_threshold : Number of failed queries in a row after which a server is only probed every `max_backoff`.
+        max_staleness : Oldest server info the `/servers` command shows before querying the servers again (in seconds).
     """
 
     servers: list[Server]
     channel: int
     query_interval: float
+    idle_interval: float = 60
+    max_backoff: float = 600
+    circuit_breaker_threshold: int = 10
+    max_staleness: float = 60
 
 
 @dataclass
-class Config:
+class DiagnosticsSettings:
+    """
+    Settings for finding out what holds up the event loop (see `bot.utils.diagnostics`).
+
+    Attributes
+    ----------
+        lag_interval : Interval for measuring the event loop lag (in seconds).
+        lag_threshold : Event loop lag above which a warning and the stack of the blocking code are logged (in seconds).
+        slow_tick : Duration of a server info update above which the stacks sampled during it are logged (in seconds).
+        slow_command : Duration of a command above which the stacks sampled during it are logged (in seconds).
+        sample_interval : Interval for sampling the stack of the event loop during timed spans (in seconds).
     """
-    Main settings class for the bot.
+
+    lag_interval: float = 0.5
+    lag_threshold: float = 0.25
+    slow_tick: float = 5
+    slow_command: float = 2
+    sample_interval: float = 0.01
+
+
+@dataclass
+class GuildSettings:
+    """
+    Settings for one guild. Extensions without settings are disabled in the guild.
 
     Attributes
     ----------
-        guild : Main guild `ID`.
+        id : Guild `ID`.
         server_browser : Settings object for the server browser extension.
         event_roster : Settings object for the event roster extension.
     """
+
+    id: int
+    server_browser: Optional[ServerBrowserSettings] = None
+    event_roster: Optional[EventSettings] = None
+
+
+@dataclass
+class Config:
+    """
+    Main settings class for the bot.
+
+    Attributes
+    ----------
+        guild : Main guild `ID` (optional, kept for single guild configs).
+        server_browser : Settings object for the server browser extension in the main guild.
+        event_roster : Settings object for the event roster extension in the main guild.
+        guilds : Settings for each of the other guilds.
+        state_dir : Directory where the bot keeps its state between restarts.
+        cache_profile : Which gateway entities the bot keeps in its cache (one of `CACHE_PROFILES`).
+        query_worker : Query game servers from a separate process instead of the bot's event loop.
+        metrics_port : Port of the local HTTP endpoint with metrics in the Prometheus text format (disabled if not set).
+        diagnostics : Settings object for event loop diagnostics (disabled if not set).
+    """
     
-    guild: int
-    server_browser: ServerBrowserSettings
-    event_roster: EventSettings
+    guild: Optional[int] = None
+    server_browser: Optional[ServerBrowserSettings] = None
+    event_roster: Optional[EventSettings] = None
+    guilds: list[GuildSettings] = field(default_factory=list)
+    state_dir: str = './state'
+    cache_profile: str = 'minimal'
+    query_worker: bool = False
+    metrics_port: Optional[int] = None
+    diagnostics: Optional[DiagnosticsSettings] = None
+
+    def __post_init__(self) -> None:
+        # The main guild is just the first one.
+        if self.guild is not None:
+            self.guilds.insert(0, GuildSettings(self.guild, self.server_browser, self.event_roster))
+
+        self._guilds_by_id: dict[int, GuildSettings] = { g.id: g for g in self.guilds }
+
+    def get_guild(self, guild_id: int) -> GuildSettings | None:
+        return self._guilds_by_id.get(guild_id)
+
+    def guild_ids(self, extension: str | None = None) -> list[int]:
+        """`ID`s of all guilds, or only of those with settings for `extension` (e.g. `event_roster`)."""
+        return [ g.id for g in self.guilds if extension is None or getattr(g, extension) is not None ]
+
+    def polled_servers(self) -> ServerBrowserSettings | None:
+        """
+        Settings for polling the servers of all guilds together: every server
+        once, as often as the most demanding guild wants it.
+        """
+        settings = [ g.server_browser for g in self.guilds if g.server_browser is not None ]
+
+        if not settings:
+            return None
+
+        servers: dict[tuple[str, int], Server] = {}
+        for conf in settings:
+            for server in conf.servers:
+                servers.setdefault((server.address, server.query_port), server)
+
+        return ServerBrowserSettings(servers=list(servers.values()),
+                                     channel=0,
+                                     query_interval=min(c.query_interval for c in settings),
+                                     idle_interval=min(c.idle_interval for c in settings),
+                                     max_backoff=min(c.max_backoff for c in settings),
+                                     circuit_breaker_threshold=max(c.circuit_breaker_threshold for c in settings))
 
     @staticmethod
-    def load_from(path: str) -> Config:
-        """Loads config from a `yaml` file."""
+    def parse(path: str) -> Config:
+        """Loads config from a `yaml` file. Raises `ConfigError` if the file is missing or invalid."""
         config: dict = {}
 
         try:
             with open(path, 'r') as config_file:
                 config = yaml.safe_load(config_file)
-        except yaml.YAMLError:
-            logging.error('Failed to parse the configuration file')
-            sys.exit(1)
-        except FileNotFoundError:
-            logging.error('Configuration file not found')
-            sys.exit(1)
+        except yaml.YAMLError as e:
+            raise ConfigError('Failed to parse the configuration file') from e
+        except FileNotFoundError as e:
+            raise ConfigError('Configuration file not found') from e
 
-        return from_dict(data_class=Config, data=config)
+        try:
+            settings = from_dict(data_class=Config, data=config)
+        except DaciteError as e:
+            raise ConfigError(f'Invalid configuration: {e}') from e
+
+        if not settings.guilds:
+            raise ConfigError('No guilds are configured')
+
+        if len(settings._guilds_by_id) != len(settings.guilds):
+            raise ConfigError('A guild is configured more than once')
+
+        if settings.cache_profile not in CACHE_PROFILES:
+            raise ConfigError(f'Unknown cache profile "{settings.cache_profile}", expected one of: {", ".join(CACHE_PROFILES)}')
+
+        return settings
+
+    @staticmethod
+    def load_from(path: str) -> Config:
+        """Loads config from a `yaml` file. Exits if the file is missing or invalid."""
+        try:
+            return Config.parse(path)
+        except ConfigError as e:
+            logging.error(e)
+            sys.exit(1)
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import signal
+
+import hikari
+from hikari.api.config import CacheComponents
+import lightbulb
+from lightbulb import commands
+
+import bot as darklight_bot
+from bot.config import ConfigError
+from bot.utils.config_reload import reload_config
+from bot.utils.outbound import respond
+
+
+plugin = lightbulb.Plugin('Admin')
+
+
+# Permission checks look up the guild, the member's roles and the channel (for overwrites).
+CACHE_COMPONENTS = CacheComponents.GUILDS | CacheComponents.ROLES | CacheComponents.GUILD_CHANNELS
+
+
+def on_sighup() -> None:
+    logging.info('Received SIGHUP, reloading configuration')
+    task = asyncio.create_task(reload_config(plugin.bot))
+    task.add_done_callback(log_reload_failure)
+
+
+def log_reload_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f'Failed to reload configuration: {task.exception()}')
+
+
+@plugin.listener(hikari.StartedEvent)
+async def on_started(_: hikari.StartedEvent) -> None:
+    if hasattr(signal, 'SIGHUP'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def on_stopping(_: hikari.StoppingEvent) -> None:
+    if hasattr(signal, 'SIGHUP'):
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+
+
+@lightbulb.add_checks(lightbulb.has_guild_permissions(hikari.Permissions.ADMINISTRATOR))
+@lightbulb.command('reload-config', 'Reload the bot\'s configuration file (admin only)', guilds=darklight_bot.config.guild_ids(), ephemeral=True)
+@lightbulb.implements(commands.SlashCommand)
+async def reload_config_command(ctx: lightbulb.context.Context) -> None:
+    instigator_log: str = f'Instigator: {ctx.author.username} ({ctx.author.id})'
+
+    try:
+        await reload_config(ctx.bot)
+    except ConfigError as e:
+        logging.error(f'Failed to reload configuration: {e}. {instigator_log}')
+        await respond(ctx, f'Failed to reload the configuration: {e}')
+        return
+
+    logging.info(f'Configuration reloaded via command. {instigator_log}')
+    await respond(ctx, 'Configuration reloaded!')
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
+    bot.command(reload_config_command)
+
+
+def unload(bot: lightbulb.BotApp) -> None:
+    command = bot.get_slash_command('reload-config')
+    if command is not None:
+        bot.remove_command(command)
+
+    bot.remove_plugin(plugin)
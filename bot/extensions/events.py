@@ -1,14 +1,19 @@
+import asyncio
 import hikari
 from hikari import MessageFlag
+from hikari.api.config import CacheComponents
 import lightbulb
 from lightbulb import commands
 from bot.config import EventSettings
-from bot import config
-from collections import Counter
-from functools import wraps
+from bot.utils.bulletin import EMBED_FIELD_MAX_CHARS, BulletinBoard
+from bot.utils.config_reload import ConfigReloadedEvent
+from bot.utils.diagnostics import timed_command
+from bot.utils.outbound import Priority, respond
 import bot as darklight_bot
+import heapq
+import itertools
 import random
-from typing import Any, Sequence
+from typing import Any, Iterable, Sequence
 import datetime as dt
 import logging
 
@@ -16,9 +21,14 @@ import logging
 plugin = lightbulb.Plugin('EventRoster')
 
 
-class AlreadyHasRole(Exception):
-    """Member already has the requested role"""
-    pass
+# The roster keeps its own index of the members it shows, so the member cache isn't needed.
+CACHE_COMPONENTS = CacheComponents.GUILDS | CacheComponents.GUILD_CHANNELS | CacheComponents.ROLES
+
+
+ROSTER_MAX_LINES = 40
+ROSTER_PAGE_PREFIX = 'roster:page:'
+EVENTS_RETRY_DELAY = 5          # first retry of a failed scheduled events fetch (in seconds), doubled on every failure
+EVENTS_MAX_RETRY_DELAY = 300
 
 
 ENLIST_MSG_1 = [
@@ -72,223 +82,740 @@ def generate_enlist_message(defect: bool = False) -> str:
     return ' '.join(msg)
 
 
-# def get_config(func):
-#     @wraps(func)
-#     def decorate(*args, ctx: lightbulb.context.Context, **kwargs):
-#         guild = ctx.get_guild()
-#         conf = config.guilds[guild.id].event_roster
-#         return func(*args, ctx=ctx, event_conf=conf, **kwargs)
+# Roles of members (by guild and member `ID`) as of their latest role edit, until the gateway confirms the edit.
+_pending_roles: dict[tuple[int, int], tuple[frozenset[int], asyncio.Future]] = {}
 
-#     return decorate
 
+def event_role_ids(conf: EventSettings) -> set[int]:
+    return { conf.axis_role, conf.allied_role, conf.sl_role }
 
-async def assign_role(member: hikari.Member, role: hikari.Role) -> None:
-    roles = member.get_roles()
 
-    if role in roles:
-        raise AlreadyHasRole
-    else:
-        await member.add_role(role)
+def current_roles(member: hikari.Member) -> set[int]:
+    """
+    Role `ID`s of a member, including role edits that are still on their way.
+
+    Commands decide on a member's roles and submit the edit without awaiting in
+    between, so commands of the same member are applied one after another,
+    each on top of the previous one.
+    """
+    pending_key = (member.guild_id, member.id)
+    pending = _pending_roles.get(pending_key)
+
+    if pending is not None:
+        role_ids, future = pending
+
+        if not future.done() or (not future.cancelled() and future.exception() is None):
+            return set(role_ids)
+
+        del _pending_roles[pending_key]
+
+    return { int(r) for r in member.role_ids if r != member.guild_id }
+
+
+def set_roles(member: hikari.Member, role_ids: set[int]) -> asyncio.Future:
+    """
+    Replaces the roles of a member with a single member edit.
+
+    Edits of the same member are keyed in the outbound scheduler, so rapid
+    repeats coalesce into one request carrying the latest roles.
+    """
+    guild_id = int(member.guild_id)
+    member_id = int(member.id)
+    role_ids = frozenset(role_ids)
+
+    future = plugin.bot.d.outbound.submit(('edit_member', guild_id),
+                                          lambda: plugin.bot.rest.edit_member(guild_id, member_id, roles=list(role_ids)),
+                                          key=('member', guild_id, member_id),
+                                          priority=Priority.ROLES)
+    _pending_roles[(member.guild_id, member.id)] = (role_ids, future)
+
+    return future
 
 
-async def remove_roles(member: hikari.Member, *role_ids: hikari.Role) -> None:
-    member_role_ids = [ r.id for r in member.get_roles() ]
-    roles_to_remove = set(role_ids).intersection(member_role_ids)
-    for role in roles_to_remove:
-        await member.remove_role(role)
+async def change_roles(ctx: lightbulb.context.Context,
+                       member: hikari.Member,
+                       role_ids: set[int],
+                       flags: MessageFlag = MessageFlag.NONE) -> bool:
+    """
+    Sets the roles of a member on behalf of a command.
 
+    Member edits are rate limited per guild, so during a signup rush the edit
+    can take longer than the 3 seconds Discord gives to respond. The response
+    is deferred (as a public message unless `flags` says otherwise) before
+    waiting for the edit, the command then responds with a followup.
 
-async def remove_all_event_roles(member: hikari.Member, *roles: hikari.Role) -> None:
-    conf: EventSettings = darklight_bot.config.event_roster
-    await remove_roles(member, 
-                       conf.axis_role,
-                       conf.allied_role,
-                       conf.sl_role)
+    Returns
+    -------
+    Whether the edit went through. If it didn't, the member has already been told.
+    """
+    edit = set_roles(member, role_ids)
 
+    await respond(ctx, hikari.ResponseType.DEFERRED_MESSAGE_CREATE, flags=flags)
 
-def has_role(member: hikari.Member, role: hikari.Role) -> bool:
     try:
-        return role in member.get_roles()
-    except TypeError:
+        await edit
+    except hikari.HTTPError:
+        logging.exception(f'Failed to update the roles of {member.id}')
+        await respond(ctx, 'Your roles couldn\'t be updated, please try again in a moment.')
         return False
 
+    return True
+
+
+class RoleIndex():
+    """
+    Members of the event roles, kept up to date from gateway member events, so
+    the roster doesn't have to walk through every member of the guild (nor
+    keep every member of the guild in the cache).
+
+    Attributes
+    ----------
+        guild_id : `ID` of the indexed guild.
+        members : `ID`s of the members that have each indexed role, by role `ID`.
+        names : Names of the members that have any indexed role, by member `ID`.
+        versions : Counter for each indexed role, bumped whenever anything shown about its members changes.
+    """
+
+    def __init__(self, guild_id: int, role_ids: Iterable[int]) -> None:
+        self.guild_id = guild_id
+        self.members: dict[int, set[int]] = { int(r): set() for r in role_ids }
+        self.names: dict[int, str] = {}
+        self.versions: dict[int, int] = { r: 0 for r in self.members }
+
+    def update_member(self, member: hikari.Member) -> bool:
+        """Updates the roles and the name of a member. Returns `True` if anything shown on the roster has changed."""
+        changed = False
+        member_role_ids = set(member.role_ids)
+        renamed = member.id in self.names and self.names[member.id] != member.username
 
-@lightbulb.option('team', 'Which team would you like to join?', choices=('Allies', 'Axis'))
-@lightbulb.command('enlist', 'Join a team for the next event', guilds=[darklight_bot.config.guild])
-@lightbulb.implements(commands.SlashCommand)
-async def enlist(ctx: lightbulb.context.Context) -> None:
-    team: str = ctx.options.team
-    guild: hikari.Guild = ctx.get_guild()
-    member: hikari.Member = guild.get_member(ctx.author.id)
-    role_to_give: hikari.Role | None
-    conf: EventSettings = darklight_bot.config.event_roster
-    axis_role = guild.get_role(conf.axis_role)
-    allied_role = guild.get_role(conf.allied_role)
+        for role_id, member_ids in self.members.items():
+            if role_id in member_role_ids:
+                if member.id not in member_ids:
+                    member_ids.add(member.id)
+                    self.versions[role_id] += 1
+                    changed = True
+                elif renamed:
+                    self.versions[role_id] += 1
+                    changed = True
+            elif member.id in member_ids:
+                member_ids.discard(member.id)
+                self.versions[role_id] += 1
+                changed = True
+
+        if any(member.id in member_ids for member_ids in self.members.values()):
+            self.names[member.id] = member.username
+        else:
+            self.names.pop(member.id, None)
+
+        return changed
 
-    match team:
-        case 'Axis':
-            role_to_give = axis_role
-        case 'Allies':
-            role_to_give = allied_role
+    def remove_member(self, member_id: int) -> bool:
+        """Removes a member who has left the guild. Returns `True` if they had any indexed role."""
+        changed = False
+
+        for role_id, member_ids in self.members.items():
+            if member_id in member_ids:
+                member_ids.discard(member_id)
+                self.versions[role_id] += 1
+                changed = True
+
+        self.names.pop(member_id, None)
+
+        return changed
+
+    def build(self, members: Iterable[hikari.Member]) -> None:
+        for role_id, member_ids in self.members.items():
+            member_ids.clear()
+            self.versions[role_id] += 1
+
+        self.names.clear()
+
+        for member in members:
+            self.update_member(member)
+
+    def get(self, role_id: int) -> set[int]:
+        return self.members.get(role_id, set())
+
+
+class RosterRenderer():
+    """
+    Renders the roster pages and keeps them until something shown on them changes.
+
+    Each team's roster is cached against the versions of its role and the squad
+    leader role in the `RoleIndex`, and the pages against those plus the next
+    event. Repeated `/event` calls and page views are served straight from the
+    cache and a change to one team only re-renders that team.
+    """
+
+    def __init__(self, index: RoleIndex) -> None:
+        self.index = index
+        self.teams: dict[int, tuple[tuple, list[list[str]]]] = {}
+        self.pages: tuple[tuple, list[hikari.Embed]] | None = None
+
+    def _team(self, role_id: int, sl_role_id: int) -> list[list[str]]:
+        key = (self.index.versions.get(role_id), self.index.versions.get(sl_role_id))
+        cached = self.teams.get(role_id)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        chunks = split_roster(format_team(self.index.names, self.index.get(role_id), self.index.get(sl_role_id)))
+        self.teams[role_id] = (key, chunks)
+
+        return chunks
+
+    def render(self, guild_id: int, conf: EventSettings, next_event: hikari.ScheduledEvent | None) -> list[hikari.Embed]:
+        event_key = (next_event.id, next_event.name, next_event.status, next_event.start_time) if next_event else None
+        key = (event_key,
+               self.index.versions.get(conf.axis_role),
+               self.index.versions.get(conf.allied_role),
+               self.index.versions.get(conf.sl_role))
+
+        if self.pages is not None and self.pages[0] == key:
+            return self.pages[1]
+
+        pages = render_roster(guild_id,
+                              next_event,
+                              self._team(conf.axis_role, conf.sl_role),
+                              len(self.index.get(conf.axis_role)),
+                              self._team(conf.allied_role, conf.sl_role),
+                              len(self.index.get(conf.allied_role)))
+        self.pages = (key, pages)
+
+        return pages
+
+
+UPCOMING_EVENT_STATUS = (hikari.ScheduledEventStatus.SCHEDULED, hikari.ScheduledEventStatus.ACTIVE)
+
+
+class ScheduledEventCache():
+    """
+    Upcoming scheduled events of a guild, kept up to date from gateway events.
+
+    Events are kept in a heap by start time. Entries of events that have since
+    been updated or deleted are left in the heap and skipped when they surface,
+    so every change is O(log n) and looking up the next event is O(1) amortized.
+    """
+
+    def __init__(self, guild_id: int) -> None:
+        self.guild_id = guild_id
+        self.events: dict[int, hikari.ScheduledEvent] = {}
+        self.heap: list[tuple[float, int, hikari.ScheduledEvent]] = []
+        self.sequence = itertools.count()
+
+    def update(self, event: hikari.ScheduledEvent) -> None:
+        if event.status not in UPCOMING_EVENT_STATUS:
+            self.remove(event.id)
+            return
+
+        self.events[event.id] = event
+        heapq.heappush(self.heap, (event.start_time.timestamp(), next(self.sequence), event))
+
+    def remove(self, event_id: int) -> None:
+        self.events.pop(event_id, None)
+
+    def build(self, events: Iterable[hikari.ScheduledEvent]) -> None:
+        self.events.clear()
+        self.heap.clear()
+
+        for event in events:
+            self.update(event)
+
+    def next(self) -> hikari.ScheduledEvent | None:
+        """Returns the scheduled or active event that starts first."""
+        while self.heap:
+            event = self.heap[0][2]
+
+            if self.events.get(event.id) is event:
+                return event
+
+            heapq.heappop(self.heap)
+
+        return None
+
+
+class Roster():
+    """Event roster of one guild: its role index, rendered pages, scheduled events and roster board."""
+
+    def __init__(self, guild_id: int, conf: EventSettings) -> None:
+        self.guild_id = guild_id
+        self.conf = conf
+        self.index: RoleIndex = RoleIndex(guild_id, (conf.axis_role, conf.allied_role, conf.sl_role))
+        self.renderer: RosterRenderer = RosterRenderer(self.index)
+        self.events: ScheduledEventCache | None = None
+        self.board_changed: asyncio.Event = asyncio.Event()
+        self.board_task: asyncio.Task | None = None
+        self.events_task: asyncio.Task | None = None
+
+    def render(self) -> list[hikari.Embed]:
+        return self.renderer.render(self.guild_id, self.conf, self.events.next() if self.events else None)
+
+    def configure(self, conf: EventSettings) -> bool:
+        """Applies new settings. Returns `True` if the role index has to be rebuilt."""
+        old, self.conf = self.conf, conf
+
+        if (old.channel, old.board_delay) != (conf.channel, conf.board_delay):
+            self.stop_board()
+            self.start_board()
+
+        self.board_changed.set()
+
+        if (old.axis_role, old.allied_role, old.sl_role) == (conf.axis_role, conf.allied_role, conf.sl_role):
+            return False
+
+        self.index = RoleIndex(self.guild_id, (conf.axis_role, conf.allied_role, conf.sl_role))
+        self.renderer = RosterRenderer(self.index)
+
+        return True
+
+    def start_board(self) -> None:
+        if self.conf.channel is not None and (self.board_task is None or self.board_task.done()):
+            self.board_task = asyncio.create_task(update_roster_board_task(self))
+
+    def stop_board(self) -> None:
+        if self.board_task is not None:
+            self.board_task.cancel()
+            self.board_task = None
+
+    def load_events(self) -> None:
+        """Fetches the scheduled events in the background, unless a fetch is already under way."""
+        if self.events_task is None or self.events_task.done():
+            self.events_task = asyncio.create_task(load_scheduled_events(self))
+
+    def stop(self) -> None:
+        self.stop_board()
+
+        if self.events_task is not None:
+            self.events_task.cancel()
+            self.events_task = None
+
+
+_rosters: dict[int, Roster] = {}
+
+
+def get_event_settings(guild_id: int) -> EventSettings | None:
+    guild = darklight_bot.config.get_guild(guild_id)
+    return guild.event_roster if guild is not None else None
+
+
+def get_roster(guild_id: int) -> Roster | None:
+    return _rosters.get(guild_id)
+
+
+async def load_scheduled_events(roster: Roster) -> None:
+    """
+    Seeds the scheduled events once, gateway events keep them up to date from there on.
+    Failed fetches are retried with backoff, the roster isn't shown until one succeeds.
+    """
+    delay: float = EVENTS_RETRY_DELAY
+
+    while True:
+        try:
+            scheduled_events = await plugin.bot.rest.fetch_scheduled_events(roster.guild_id)
+            break
+        except hikari.HTTPError:
+            logging.error(f'Failed to fetch scheduled events of guild {roster.guild_id}, retrying in {delay}s', exc_info=True)
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, EVENTS_MAX_RETRY_DELAY)
+
+    cache = ScheduledEventCache(roster.guild_id)
+    cache.build(scheduled_events)
+    roster.events = cache
+    roster.board_changed.set()
+
+
+@plugin.listener(hikari.GuildAvailableEvent)
+async def on_guild_available(event: hikari.GuildAvailableEvent) -> None:
+    conf: EventSettings | None = get_event_settings(event.guild_id)
+
+    if conf is None:
+        return
+
+    roster = _rosters.get(event.guild_id)
+
+    if roster is None:
+        roster = _rosters[event.guild_id] = Roster(event.guild_id, conf)
+
+    roster.index.build(event.members.values())
+    roster.board_changed.set()
+    logging.info(f'Indexed event roles of {len(event.members)} members of guild {event.guild_id}')
+
+    roster.load_events()
+    roster.start_board()
+
+
+@plugin.listener(hikari.ScheduledEventCreateEvent)
+@plugin.listener(hikari.ScheduledEventUpdateEvent)
+async def on_scheduled_event_update(event: hikari.ScheduledEventCreateEvent | hikari.ScheduledEventUpdateEvent) -> None:
+    roster = get_roster(event.guild_id)
+
+    if roster is not None and roster.events is not None:
+        roster.events.update(event.event)
+        roster.board_changed.set()
+
+
+@plugin.listener(hikari.ScheduledEventDeleteEvent)
+async def on_scheduled_event_delete(event: hikari.ScheduledEventDeleteEvent) -> None:
+    roster = get_roster(event.guild_id)
+
+    if roster is not None and roster.events is not None:
+        roster.events.remove(event.event.id)
+        roster.board_changed.set()
+
+
+async def update_roster_board_task(roster: Roster) -> None:
+    """
+    Task keeping the roster posted in the roster channel up to date.
+
+    Changes are collected for `board_delay` seconds before the roster is
+    rendered, so a burst of signups ends up as a single message edit.
+    """
+    conf: EventSettings = roster.conf
 
     try:
-        await assign_role(member, role_to_give)
-    except AlreadyHasRole:
-        await ctx.respond(f'You\'re already on **{team}** team!', flags=MessageFlag.EPHEMERAL)
+        channel = await plugin.bot.rest.fetch_channel(conf.channel)
+    except Exception:
+        logging.error(f'Failed to fetch roster channel {conf.channel}', exc_info=True)
         return
 
-    defected: bool = has_role(member, axis_role) | has_role(member, allied_role)
+    if not isinstance(channel, hikari.TextableChannel):
+        logging.error(f'Roster channel {conf.channel} is not a textable channel!')
+        return
 
-    await remove_all_event_roles(member)
+    logging.info(f'Fetched roster channel #{channel.name} ({channel.id})')
 
-    msg = generate_enlist_message(defected).format(member=ctx.author.mention, team=team)
+    # The main guild keeps the state name from before there were multiple guilds.
+    name: str = 'event_roster' if roster.guild_id == darklight_bot.config.guild else f'event_roster.{roster.guild_id}'
+    board: BulletinBoard = BulletinBoard(plugin.bot, darklight_bot.state, name, plugin.bot.d.outbound)
 
-    await ctx.respond(msg)
+    while True:
+        await roster.board_changed.wait()
+        await asyncio.sleep(conf.board_delay)
+        roster.board_changed.clear()
 
+        if roster.events is None:
+            continue
 
-@lightbulb.command('leave-team', 'I want to quit my team', guilds=[darklight_bot.config.guild])
-@lightbulb.implements(commands.SlashCommand)
-async def leave_team(ctx: lightbulb.context.Context) -> None:
-    guild: hikari.Guild = ctx.get_guild()
-    member: hikari.Member = guild.get_member(ctx.author.id)
+        board.clear()
+        for page in roster.render():
+            board.add_embed(page)
 
-    await remove_all_event_roles(member)
-    await ctx.respond(f'You\'ve quit your team!', flags=MessageFlag.EPHEMERAL)
+        try:
+            await board.push_to_channel(channel)
+        except Exception:
+            logging.error('Failed to update the roster channel', exc_info=True)
+            roster.board_changed.set()
 
 
-@lightbulb.command('reserve-sl', 'I want to be a squad leader for the next event', guilds=[darklight_bot.config.guild])
-@lightbulb.implements(commands.SlashCommand)
-async def reserve_sl(ctx: lightbulb.context.Context) -> None:
-    guild: hikari.Guild = ctx.get_guild()
-    member: hikari.Member = guild.get_member(ctx.author.id)
-    conf: EventSettings = darklight_bot.config.event_roster
+@plugin.listener(ConfigReloadedEvent)
+async def on_config_reloaded(event: ConfigReloadedEvent) -> None:
+    for guild_id, roster in list(_rosters.items()):
+        if get_event_settings(guild_id) is None:
+            roster.stop()
+            del _rosters[guild_id]
 
-    on_team: bool = has_role(member, guild.get_role(conf.axis_role)) or has_role(member, guild.get_role(conf.allied_role))
+    for guild_id in event.new.guild_ids('event_roster'):
+        conf: EventSettings = get_event_settings(guild_id)
+        roster = _rosters.get(guild_id)
 
-    if not on_team:
-        await ctx.respond(f'Join a team first! You can do this via the `/enlist` command.', flags=MessageFlag.EPHEMERAL)
+        if roster is None:
+            roster = _rosters[guild_id] = Roster(guild_id, conf)
+            roster.load_events()
+            roster.start_board()
+        elif roster.conf == conf or not roster.configure(conf):
+            continue
+
+        # Build the index from a fresh member chunk (it comes in as member chunk events).
+        await plugin.bot.request_guild_members(guild_id)
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def on_stopping(_: hikari.StoppingEvent) -> None:
+    for roster in _rosters.values():
+        roster.stop()
+
+
+@plugin.listener(hikari.MemberChunkEvent)
+async def on_member_chunk(event: hikari.MemberChunkEvent) -> None:
+    roster = get_roster(event.guild_id)
+
+    if roster is not None:
+        for member in event.members.values():
+            if roster.index.update_member(member):
+                roster.board_changed.set()
+
+
+@plugin.listener(hikari.MemberCreateEvent)
+@plugin.listener(hikari.MemberUpdateEvent)
+async def on_member_update(event: hikari.MemberCreateEvent | hikari.MemberUpdateEvent) -> None:
+    roster = get_roster(event.guild_id)
+
+    if roster is None:
+        return
+
+    pending_key = (event.guild_id, event.member.id)
+    pending = _pending_roles.get(pending_key)
+
+    if pending is not None and pending[1].done():
+        del _pending_roles[pending_key]
+
+    if roster.index.update_member(event.member):
+        roster.board_changed.set()
+
+
+@plugin.listener(hikari.MemberDeleteEvent)
+async def on_member_delete(event: hikari.MemberDeleteEvent) -> None:
+    _pending_roles.pop((event.guild_id, event.user_id), None)
+    roster = get_roster(event.guild_id)
+
+    if roster is not None and roster.index.remove_member(event.user_id):
+        roster.board_changed.set()
+
+
+def format_team(names: dict[int, str], member_ids: set[int], leader_ids: set[int]) -> list[str]:
+    """Lines of a team roster: squad leaders first, then the rest of the members (sorted by name)."""
+
+    def team_names(ids: Iterable[int]) -> list[str]:
+        known_ids = [ i for i in ids if i in names ]
+        return [ names[i] for i in sorted(known_ids, key=lambda i: (names[i].casefold(), i)) ] or ['-NONE-']
+
+    return ['Squad Leaders:', *team_names(member_ids & leader_ids), '', 'Members:', *team_names(member_ids - leader_ids)]
+
+
+def split_roster(lines: list[str]) -> list[list[str]]:
+    """Splits roster lines into chunks that fit in a roster field (with room for the padding and total)."""
+    budget: int = EMBED_FIELD_MAX_CHARS - len('```yaml\n\n\nTotal: 9999999```') - ROSTER_MAX_LINES
+    chunks: list[list[str]] = [[]]
+    length: int = 0
+
+    for line in lines:
+        if chunks[-1] and (len(chunks[-1]) >= ROSTER_MAX_LINES or length + len(line) + 1 > budget):
+            chunks.append([])
+            length = 0
+
+            if not line:
+                continue
+
+        chunks[-1].append(line)
+        length += len(line) + 1
+
+    return chunks
+
+
+def render_roster(guild_id: int,
+                  next_event: hikari.ScheduledEvent | None,
+                  axis_roster: list[list[str]],
+                  axis_total: int,
+                  allied_roster: list[list[str]],
+                  allied_total: int) -> list[hikari.Embed]:
+    """Renders the roster pages, each one with the next chunk of both teams side by side."""
+    page_count: int = max(len(axis_roster), len(allied_roster))
+    pages: list[hikari.Embed] = []
+
+    for idx in range(page_count):
+        embed = hikari.Embed(title='EVENT ROSTER', description='')
+        help: str = f'Commands:\n/enlist - to join a team.\n/leave-team - to quit your team\n/reserve-sl - to volunteer as a squad leader.\n/rescind-sl - to rescind your SL reservation.'
+
+        if page_count > 1:
+            help += f'\n\nPage {idx + 1} of {page_count}'
+
+        embed.set_footer(help)
+
+        # SET EVENT INFO
+        if next_event:
+            time_until_event: str = '<t:{time}:R>'.format(time=int(next_event.start_time.timestamp()))
+            embed.title += f' - {next_event.name}'
+
+            if next_event.status == hikari.ScheduledEventStatus.SCHEDULED:
+                embed.description += f'\nEvent starts {time_until_event}'
+            elif next_event.status == hikari.ScheduledEventStatus.ACTIVE:
+                embed.description += f'\nEvent is underway!'
+
+            embed.url = 'https://discord.com/events/' + str(guild_id) + '/' + str(next_event.id)
+        else:
+            embed.description += 'No events are scheduled at the moment.'
+
+        # ROSTER
+        axis_lines: list[str] = axis_roster[idx] if idx < len(axis_roster) else []
+        allied_lines: list[str] = allied_roster[idx] if idx < len(allied_roster) else []
+        roster_diff: int = len(axis_lines) - len(allied_lines)
+        axis_padding: str = ''
+        allied_padding: str = ''
+
+        if roster_diff < 0:
+            axis_padding = '\n' * abs(roster_diff)
+        elif roster_diff > 0:
+            allied_padding = '\n' * roster_diff
+
+        embed.add_field(name='AXIS', 
+                        value='```yaml\n' + '\n'.join(axis_lines) + axis_padding + f'\n\nTotal: {axis_total}```', 
+                        inline=True)
+
+        embed.add_field(name='ALLIES', 
+                        value='```yaml\n' + '\n'.join(allied_lines) + allied_padding + f'\n\nTotal: {allied_total}```',
+                        inline=True)
+
+        pages.append(embed)
+
+    return pages
+
+
+def roster_navigation(page: int, page_count: int) -> hikari.api.MessageActionRowBuilder:
+    """Buttons for browsing the roster pages."""
+    row = plugin.bot.rest.build_message_action_row()
+
+    (row.add_button(hikari.ButtonStyle.SECONDARY, f'{ROSTER_PAGE_PREFIX}{page - 1}')
+        .set_label('Previous')
+        .set_is_disabled(page <= 0)
+        .add_to_container())
+
+    (row.add_button(hikari.ButtonStyle.SECONDARY, f'{ROSTER_PAGE_PREFIX}{page + 1}')
+        .set_label('Next')
+        .set_is_disabled(page >= page_count - 1)
+        .add_to_container())
+
+    return row
+
+
+@plugin.listener(hikari.InteractionCreateEvent)
+async def on_roster_page(event: hikari.InteractionCreateEvent) -> None:
+    """Shows another page of the roster in a `/event` response, served from the rendered pages."""
+    interaction = event.interaction
+
+    if not isinstance(interaction, hikari.ComponentInteraction) or not interaction.custom_id.startswith(ROSTER_PAGE_PREFIX):
         return
 
+    roster = get_roster(interaction.guild_id) if interaction.guild_id else None
+
+    if roster is None or roster.events is None:
+        return
+
+    pages: list[hikari.Embed] = roster.render()
+
     try:
-        await assign_role(member, conf.sl_role)
-    except AlreadyHasRole:
-        await ctx.respond(f'You\'ve already volunteered to be a squad leader!', flags=MessageFlag.EPHEMERAL)
+        page: int = int(interaction.custom_id[len(ROSTER_PAGE_PREFIX):])
+    except ValueError:
         return
 
-    await ctx.respond(f'{ctx.author.mention} has volunteered to lead a squad. Don\'t forget to place rally points!')
+    page = max(0, min(page, len(pages) - 1))
+    component = roster_navigation(page, len(pages)) if len(pages) > 1 else None
 
+    await plugin.bot.d.outbound.send(('interaction',),
+                                     lambda: interaction.create_initial_response(hikari.ResponseType.MESSAGE_UPDATE,
+                                                                                 embed=pages[page],
+                                                                                 component=component),
+                                     priority=Priority.INTERACTION)
 
-@lightbulb.command('rescind-sl', 'I don\'t want to be a squad leader anymore. Take away my role', guilds=[darklight_bot.config.guild])
+
+@lightbulb.option('team', 'Which team would you like to join?', choices=('Allies', 'Axis'))
+@lightbulb.command('enlist', 'Join a team for the next event', guilds=darklight_bot.config.guild_ids('event_roster'))
 @lightbulb.implements(commands.SlashCommand)
-async def rescind_sl(ctx: lightbulb.context.Context) -> None:
-    guild: hikari.Guild = ctx.get_guild()
-    member: hikari.Member = guild.get_member(ctx.author.id)
-    conf: EventSettings = darklight_bot.config.event_roster
+@timed_command
+async def enlist(ctx: lightbulb.context.Context) -> None:
+    team: str = ctx.options.team
+    member: hikari.Member = ctx.member
+    conf: EventSettings = get_event_settings(ctx.guild_id)
 
-    if has_role(member, conf.sl_role):
-        await remove_roles(member, conf.sl_role)
-        await ctx.respond(f'{ctx.author.mention} no longer wants to lead a squad.')
-    else:
-        await ctx.respond(f'You\'re not a squad leader!', flags=MessageFlag.EPHEMERAL)
+    match team:
+        case 'Axis':
+            role_to_give = conf.axis_role
+        case 'Allies':
+            role_to_give = conf.allied_role
 
+    roles = current_roles(member)
 
-@lightbulb.command('event', 'Show the roster for the next event', guilds=[darklight_bot.config.guild], ephemeral=True)
+    if role_to_give in roles:
+        await respond(ctx, f'You\'re already on **{team}** team!', flags=MessageFlag.EPHEMERAL)
+        return
+
+    defected: bool = bool(roles & { conf.axis_role, conf.allied_role })
+
+    if not await change_roles(ctx, member, (roles - event_role_ids(conf)) | { role_to_give }):
+        return
+
+    msg = generate_enlist_message(defected).format(member=ctx.author.mention, team=team)
+
+    await respond(ctx, msg)
+
+
+@lightbulb.command('leave-team', 'I want to quit my team', guilds=darklight_bot.config.guild_ids('event_roster'))
 @lightbulb.implements(commands.SlashCommand)
-async def event(ctx: lightbulb.context.Context) -> None:
-    guild: hikari.Guild = ctx.get_guild()
-    members = [ m[1] for m in guild.get_members().items() ]
-    conf: EventSettings = darklight_bot.config.event_roster
-    squad_leaders = set(m for m in members if has_role(m, guild.get_role(conf.sl_role)))
-
-    events: Sequence[hikari.ScheduledEvent] = await ctx.bot.rest.fetch_scheduled_events(guild)
-    embed = hikari.Embed(title='EVENT ROSTER', description='')
-    help: str = f'Commands:\n/enlist - to join a team.\n/leave-team - to quit your team\n/reserve-sl - to volunteer as a squad leader.\n/rescind-sl - to rescind your SL reservation.'
-    embed.set_footer(help)
-
-    # SET EVENT INFO
-    sorted_events: list[hikari.ScheduledEvent] = sorted(events, key=lambda x: x.start_time)
-    next_event: hikari.ScheduledEvent = next(filter(lambda e: e.status & (hikari.ScheduledEventStatus.SCHEDULED | hikari.ScheduledEventStatus.ACTIVE), 
-                                                              sorted_events), 
-                                                       None)
-
-    if next_event:
-        time_until_event: str = '<t:{time}:R>'.format(time=int(next_event.start_time.timestamp()))
-        embed.title += f' - {next_event.name}'
-
-        if next_event.status & hikari.ScheduledEventStatus.SCHEDULED:
-            embed.description += f'\nEvent starts {time_until_event}'
-        elif next_event.status & hikari.ScheduledEventStatus.ACTIVE:
-            embed.description += f'\nEvent is underway!'
-
-        embed.url = 'https://discord.com/events/' + str(guild.id) + '/' + str(next_event.id)
-    else:
-        embed.description += 'No events are scheduled at the moment.'
+@timed_command
+async def leave_team(ctx: lightbulb.context.Context) -> None:
+    member: hikari.Member = ctx.member
+    conf: EventSettings = get_event_settings(ctx.guild_id)
+    roles = current_roles(member)
 
+    if roles & event_role_ids(conf):
+        if not await change_roles(ctx, member, roles - event_role_ids(conf), MessageFlag.EPHEMERAL):
+            return
 
-    # TODO: REFACTOR THIS MESS!
+    await respond(ctx, f'You\'ve quit your team!', flags=MessageFlag.EPHEMERAL)
 
-    # AXIS
-    axis_members = [ m for m in members if has_role(m, guild.get_role(conf.axis_role)) ]
 
-    axis_squad_leaders = squad_leaders.intersection(axis_members)
-    if axis_squad_leaders:
-        axis_squad_leaders_text = '\n'.join([ m.username for m in axis_squad_leaders ])
-    else:
-        axis_squad_leaders_text = '-NONE-'
+@lightbulb.command('reserve-sl', 'I want to be a squad leader for the next event', guilds=darklight_bot.config.guild_ids('event_roster'))
+@lightbulb.implements(commands.SlashCommand)
+@timed_command
+async def reserve_sl(ctx: lightbulb.context.Context) -> None:
+    member: hikari.Member = ctx.member
+    conf: EventSettings = get_event_settings(ctx.guild_id)
+    roles = current_roles(member)
 
-    axis_rest = [*(Counter(axis_members) - Counter(axis_squad_leaders)).elements()]
+    on_team: bool = bool(roles & { conf.axis_role, conf.allied_role })
 
-    if axis_rest:
-        axis_rest_text = '\n'.join([ m.username for m in axis_rest ])
-    else:
-        axis_rest_text = '-NONE-'
+    if not on_team:
+        await respond(ctx, f'Join a team first! You can do this via the `/enlist` command.', flags=MessageFlag.EPHEMERAL)
+        return
 
+    if conf.sl_role in roles:
+        await respond(ctx, f'You\'ve already volunteered to be a squad leader!', flags=MessageFlag.EPHEMERAL)
+        return
 
-    # ALLIES
-    allied_members = [ m for m in members if has_role(m, guild.get_role(conf.allied_role)) ]
+    if not await change_roles(ctx, member, roles | { conf.sl_role }):
+        return
 
-    allied_squad_leaders = squad_leaders.intersection(allied_members)
+    await respond(ctx, f'{ctx.author.mention} has volunteered to lead a squad. Don\'t forget to place rally points!')
 
-    if allied_squad_leaders:
-        allied_squad_leaders_text = '\n'.join([ m.username for m in allied_squad_leaders ])
-    else:
-        allied_squad_leaders_text = '-NONE-'
 
-    allied_rest = [*(Counter(allied_members) - Counter(allied_squad_leaders)).elements()]
+@lightbulb.command('rescind-sl', 'I don\'t want to be a squad leader anymore. Take away my role', guilds=darklight_bot.config.guild_ids('event_roster'))
+@lightbulb.implements(commands.SlashCommand)
+@timed_command
+async def rescind_sl(ctx: lightbulb.context.Context) -> None:
+    member: hikari.Member = ctx.member
+    conf: EventSettings = get_event_settings(ctx.guild_id)
+    roles = current_roles(member)
 
-    if allied_rest:
-        allied_rest_text = '\n'.join([ m.username for m in allied_rest ])
+    if conf.sl_role in roles:
+        if await change_roles(ctx, member, roles - { conf.sl_role }):
+            await respond(ctx, f'{ctx.author.mention} no longer wants to lead a squad.')
     else:
-        allied_rest_text = '-NONE-'
-
-    axis_roster: str = f'\nSquad Leaders:\n{axis_squad_leaders_text}\n\nMembers:\n{axis_rest_text}'
-    allied_roster: str = f'\nSquad Leaders:\n{allied_squad_leaders_text}\n\nMembers:\n{allied_rest_text}' 
+        await respond(ctx, f'You\'re not a squad leader!', flags=MessageFlag.EPHEMERAL)
 
-    roster_diff: int = axis_roster.count('\n') - allied_roster.count('\n')
-    axis_padding: str = ''
-    allied_padding: str = ''
-    
-    if roster_diff < 0:
-        axis_padding = '\n' * abs(roster_diff)
-    elif roster_diff > 0:
-        allied_padding = '\n' * roster_diff
 
+@lightbulb.command('event', 'Show the roster for the next event', guilds=darklight_bot.config.guild_ids('event_roster'), ephemeral=True)
+@lightbulb.implements(commands.SlashCommand)
+@timed_command
+async def event(ctx: lightbulb.context.Context) -> None:
+    roster = get_roster(ctx.guild_id)
 
-    embed.add_field(name='AXIS', 
-                    value='```yaml' + axis_roster + axis_padding + f'\n\nTotal: {len(axis_members)}```', 
-                    inline=True)
+    if roster is None or roster.events is None:
+        await respond(ctx, 'The roster isn\'t ready yet, try again in a moment.')
+        return
 
-    embed.add_field(name='ALLIES', 
-                    value='```yaml' + allied_roster + allied_padding + f'\n\nTotal: {len(allied_members)}```',
-                    inline=True)
+    pages: list[hikari.Embed] = roster.render()
 
-    await ctx.respond(embed=embed)
+    if len(pages) > 1:
+        await respond(ctx, embed=pages[0], component=roster_navigation(0, len(pages)))
+    else:
+        await respond(ctx, embed=pages[0])
 
 
 @lightbulb.add_checks(lightbulb.has_guild_permissions(hikari.Permissions.ADMINISTRATOR))
 @lightbulb.option('message', 'Bot message')
-@lightbulb.command('say', 'Say something in the current channel (admin only)', guilds=[darklight_bot.config.guild], ephemeral=True)
+@lightbulb.command('say', 'Say something in the current channel (admin only)', guilds=darklight_bot.config.guild_ids(), ephemeral=True)
 @lightbulb.implements(commands.SlashCommand)
+@timed_command
 async def say(ctx: lightbulb.context.Context) -> None:
     instigator_log: str = f'Instigator: {ctx.author.username} ({ctx.author.id})'
 
@@ -305,16 +832,20 @@ async def say(ctx: lightbulb.context.Context) -> None:
         logging.error(f'An error has occured while sending a message. {instigator_log}', exc_info=True)
         return
 
-    await ctx.respond(content='Message sent!')
+    await respond(ctx, content='Message sent!')
 
 
 def load(bot: lightbulb.BotApp) -> None:
     bot.add_plugin(plugin)
-    bot.command(enlist)
-    bot.command(leave_team)
-    bot.command(reserve_sl)
-    bot.command(rescind_sl)
-    bot.command(event)
+
+    # Commands without any guilds would be registered globally.
+    if darklight_bot.config.guild_ids('event_roster'):
+        bot.command(enlist)
+        bot.command(leave_team)
+        bot.command(reserve_sl)
+        bot.command(rescind_sl)
+        bot.command(event)
+
     bot.command(say)
 
 
@@ -0,0 +1,88 @@
+import logging
+import time
+
+from aiohttp import web
+import hikari
+from hikari.api.config import CacheComponents
+import lightbulb
+
+import bot as darklight_bot
+from bot.utils import diagnostics, metrics
+
+
+plugin = lightbulb.Plugin('Monitoring')
+
+
+CACHE_COMPONENTS = CacheComponents.NONE
+
+
+COMMAND_DURATION = metrics.histogram('darklight_command_seconds', 'Time from invoking a command to its completion by command and outcome', ('command', 'result'))
+
+
+_metrics_server: web.AppRunner | None = None
+_invoked_at: dict[int, float] = {}
+
+
+@plugin.listener(hikari.StartedEvent)
+async def on_started(_: hikari.StartedEvent) -> None:
+    global _metrics_server
+
+    if darklight_bot.config.diagnostics is not None:
+        diagnostics.enable(darklight_bot.config.diagnostics)
+        logging.info('Event loop diagnostics enabled')
+
+    port: int | None = darklight_bot.config.metrics_port
+
+    if port is None:
+        return
+
+    try:
+        _metrics_server = await metrics.serve(port)
+        logging.info(f'Serving metrics at http://127.0.0.1:{port}/metrics')
+    except OSError:
+        logging.error(f'Failed to serve metrics on port {port}', exc_info=True)
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def on_stopping(_: hikari.StoppingEvent) -> None:
+    global _metrics_server
+
+    diagnostics.disable()
+
+    if _metrics_server is not None:
+        await _metrics_server.cleanup()
+        _metrics_server = None
+
+
+@plugin.listener(lightbulb.CommandInvocationEvent)
+async def on_command_invoked(event: lightbulb.CommandInvocationEvent) -> None:
+    _invoked_at[id(event.context)] = time.perf_counter()
+
+
+def observe_command(context: lightbulb.context.Context, result: str) -> None:
+    invoked_at: float | None = _invoked_at.pop(id(context), None)
+
+    # Commands failing their checks are never invoked.
+    if invoked_at is not None and context.command is not None:
+        COMMAND_DURATION.observe(time.perf_counter() - invoked_at, context.command.qualname, result)
+
+
+@plugin.listener(lightbulb.CommandCompletionEvent)
+async def on_command_completed(event: lightbulb.CommandCompletionEvent) -> None:
+    observe_command(event.context, 'ok')
+
+
+@plugin.listener(lightbulb.CommandErrorEvent)
+async def on_command_error(event: lightbulb.CommandErrorEvent) -> None:
+    observe_command(event.context, 'error')
+
+    # Having a listener marks the error as handled, so lightbulb no longer logs it.
+    logging.error('Command failed', exc_info=event.exception)
+
+
+def load(bot: lightbulb.BotApp) -> None:
+    bot.add_plugin(plugin)
+
+
+def unload(bot: lightbulb.BotApp) -> None:
+    bot.remove_plugin(plugin)
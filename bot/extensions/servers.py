@@ -1,213 +1,505 @@
-from typing import Sequence, Iterator
+from typing import Sequence
 
 import logging
 import asyncio
+import dataclasses
+import datetime as dt
+import os
 import time
 
 import hikari
+from hikari.api.config import CacheComponents
 import lightbulb
-from lightbulb.ext import tasks
+from lightbulb import commands
 
 import bot as darklight_bot
 from bot.config import ServerBrowserSettings
-from bot.utils import unreal_query
+from bot.utils import diagnostics, metrics
+from bot.utils.config_reload import ConfigReloadedEvent
+from bot.utils.bulletin import BulletinBoard, layout_messages
+from bot.utils.history import HistoryStore, compute_stats
+from bot.utils.outbound import Priority, respond
+from bot.utils.query_worker import RemoteServerCollection
+from bot.utils.server_list import Server, ServerCollection
 
 
 plugin = lightbulb.Plugin('ServerBrowser')
 
 
-class Server():
-    def __init__(self, addr: tuple[str, int], default_name: str) -> None:
-        self.name = default_name
-        self.addr = addr
-        self.info: unreal_query.ServerInfo | None = None
-        self.players: int = 0
-        self.max_players: int = 0
-        self.map: str = ''
-        self.failed_updates: int = 0
-        self.is_online: bool = False
-
-    async def update(self) -> None:
-        self.info = await unreal_query.query(self.addr)
-
-        if self.info:
-            self.name = self.info.name
-            self.map = self.info.map
-            self.players = self.info.players
-            self.max_players = self.info.max_players
-            self.failed_updates = 0
-            self.is_online = True
-        else:
-            self.failed_updates = min(self.failed_updates + 1, 3)
-
-            if self.failed_updates >= 3:
-                self.is_online = False
-                self.players = 0
-            else:
-                self.map = 'Refreshing...'
+# Bulletin boards look for their messages by the bot's own user.
+CACHE_COMPONENTS = CacheComponents.ME
 
 
-class ServerCollection():
-    def __init__(self, servers: Sequence[Server]):
-        self.servers = servers
+# Each page has its own message, and with fields clipped to these lengths a
+# full page stays within Discord's 6000 characters per message.
+SERVERS_PER_PAGE = 24
+PAGES_PER_MESSAGE = 1
+SERVER_NAME_MAX_CHARS = 100
+MAP_NAME_MAX_CHARS = 64
+REFRESH_TIMEOUT = 5
+SERVERS_PAGE_PREFIX = 'servers:page:'
 
-    def __iter__(self) -> Iterator[Server]:
-        for s in self.servers:
-            yield s
+TICK_DURATION = metrics.histogram('darklight_tick_seconds', 'Time from waking up the server info task to having updated all boards')
+TICK_PHASE_DURATION = metrics.histogram('darklight_tick_phase_seconds', 'Time spent in each phase of a tick (query, save, render or publish)', ('phase',))
 
-    def __bool__(self) -> bool:
-        return any(True for _ in self.servers)
 
-    def get_total_players(self) -> int:
-        return sum([ s.players for s in self.servers])
+def set_presence(bot: lightbulb.BotApp, activity: hikari.Activity | None) -> None:
+    """
+    Queues a presence update without waiting for it. Presence updates are only
+    allowed a few times a minute, a newer update replaces one still queued.
+    """
 
-    async def update(self) -> None:
-        coros = [ s.update() for s in self.servers ]
-        await asyncio.gather(*coros)
+    def log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logging.error('Failed to update presence', exc_info=future.exception())
 
+    future = bot.d.outbound.submit(('presence',),
+                                   lambda: bot.update_presence(activity=activity),
+                                   key='presence',
+                                   priority=Priority.PRESENCE)
+    future.add_done_callback(log_failure)
 
-class BulletinBoard():
-    """A class for publishing embeds into multiple persistent messages and keeping them updated"""
 
-    def __init__(self) -> None:
-        self.embeds: list[hikari.Embed] = []
-
-    def add_embed(self, embed: hikari.Embed) -> None:
-        """Adds an embed to be published on the board"""
-        self.embeds.append(embed)
+def update_presence_player_count(bot: lightbulb.BotApp,
+                                 servers: ServerCollection) -> None:
+    """Update bot's status message with the current player count."""
 
-    async def push_to_channel(self, channel: hikari.TextableChannel) -> None:
-        """
-        Updates bot's latest messages with current embeds. New messages are created if necessary.
+    total_players: int = servers.get_total_players()
+    presence_text: str = '{num} player{s} online'.format(num=total_players, s='s' if total_players != 1 else '')
 
-        Parameters
-        ----------
-        channel : Textable channel to update
-        """
+    set_presence(bot, hikari.Activity(type=hikari.ActivityType.WATCHING, name=presence_text))
 
-        me: hikari.OwnUser | None = plugin.bot.get_me()
 
-        if not me:
-            logging.error('Failed to fetch the bot user.')
-            return
+def render_server_list(servers: Sequence[Server]) -> list[hikari.Embed]:
+    """
+    Renders the server list, one embed per page of `SERVERS_PER_PAGE` servers.
 
-        try:
-            messages: list[hikari.Message] = [ x
-                                               for x in await plugin.bot.rest.fetch_messages(channel)
-                                               if x.author.id == me.id ]
+    Servers have a fixed page by their configured position (they're only
+    sorted by player count within it) and offline servers are hidden within
+    their page, so a change to one server only re-renders its own page.
+    """
+    pages: list[hikari.Embed] = []
 
-            messages_reversed: list[hikari.Message] = [*reversed(messages[:len(self.embeds)])]
+    for page_start in range(0, max(len(servers), 1), SERVERS_PER_PAGE):
+        if page_start == 0:
+            page = hikari.Embed(title='Darkest Hour: Europe \'44-\'45 Servers',
+                                description=f'Updated <t:{int(time.time())}:R>.\n\u2800')
+        else:
+            page = hikari.Embed()
 
-            for idx, embed in enumerate(self.embeds):
-                if idx >= len(messages_reversed):
-                    await channel.send(content='', embed=embed)
-                else:
-                    # WARNING: This will hit rate limiter when there are too many messages to edit!
-                    await messages_reversed[idx].edit(content='', embed=embed)
+        online_servers: list[Server] = [ s for s in servers[page_start:page_start + SERVERS_PER_PAGE] if s.is_online ]
 
-        except Exception:
-            logging.error('Failed to update the server info channel', exc_info=True)
+        for s in sorted(online_servers, key=lambda x: x.players, reverse=True):
+            status_emoji: str = ':green_circle:' if s.players > 0 else ':yellow_circle:'
+            map: str = s.map.replace('DH-', '').replace('_', ' ')[:MAP_NAME_MAX_CHARS]
+            page.add_field(name=f'{status_emoji} {s.name[:SERVER_NAME_MAX_CHARS]}',
+                           value=f'**Players**\t`{s.players} / {s.max_players}`\n**Map**\t`{map}`\n\u2800',
+                           inline=False)
 
+        # Discord doesn't accept empty embeds.
+        if not page.fields and not page.description:
+            page.description = '\u2800'
 
-async def update_presence_player_count(bot: lightbulb.BotApp, 
-                                       servers: ServerCollection) -> None:
-    """Update bot's status message with the current player count."""
+        pages.append(page)
 
-    total_players: int = servers.get_total_players()
-    presence_text: str = '{num} player{s} online'.format(num=total_players, s='s' if total_players != 1 else '')
+    if not servers and pages[0].description:
+        pages[0].description += '\nServers are down for maintenance...'
 
-    try:
-        await bot.update_presence(activity=hikari.Activity(type=hikari.ActivityType.WATCHING, name=presence_text))
+    return pages
 
-    except Exception:
-        logging.error('Failed to update presence', exc_info=True)
 
+async def update_server_info_channel(servers: Sequence[Server],
+                                     board: BulletinBoard,
+                                     channel: hikari.TextableChannel) -> bool:
+    """Update or post server list to the specified channel. Returns `False` if the update failed."""
 
-async def update_server_info_channel(servers: ServerCollection, 
-                             channel: hikari.TextableChannel) -> None:
-    """Update or post server list to the specified channel."""
+    board.clear()
+    with TICK_PHASE_DURATION.time('render'):
+        for page in render_server_list(servers):
+            board.add_embed(page)
 
-    board: BulletinBoard = BulletinBoard()
-    embed: hikari.Embed = hikari.Embed(title='Darkest Hour: Europe \'44-\'45 Servers', 
-                                       description=f'Updated <t:{int(time.time())}:R>.\n\u2800')
-
-    # Build the server list
-    if servers:
-        sorted_servers = sorted(servers, key=lambda x: x.players, reverse=True)
-        for s in sorted_servers:
-            if s.is_online:
-                status_emoji: str = ':green_circle:' if s.players > 0 else ':yellow_circle:'
-                map: str = s.map.replace('DH-', '').replace('_', ' ')
-                embed.add_field(name=f'{status_emoji} {s.name}', 
-                                value=f'**Players**\t`{s.players} / {s.max_players}`\n**Map**\t`{map}`\n\u2800')
-    elif embed.description:
-        embed.description += '\nServers are down for maintenance...'
+    try:
+        with TICK_PHASE_DURATION.time('publish'):
+            await board.push_to_channel(channel)
+    except Exception:
+        logging.error('Failed to update the server info channel', exc_info=True)
+        return False
 
-    board.add_embed(embed)
-    await board.push_to_channel(channel)
+    return True
 
 
-async def fetch_server_info_channel() -> hikari.TextableChannel | None:
+async def fetch_server_info_channel(channel_id: int) -> hikari.TextableChannel | None:
     """Fetch the channel where the server list will be posted"""
 
-    conf: ServerBrowserSettings = darklight_bot.config.server_browser
-
     try: 
-        channel: hikari.PartialChannel = await plugin.bot.rest.fetch_channel(conf.channel)
+        channel: hikari.PartialChannel = await plugin.bot.rest.fetch_channel(channel_id)
 
         if isinstance(channel, hikari.TextableChannel):
             logging.info(f'Fetched server info channel #{channel.name} ({channel.id})')
             return channel
         else:
-            logging.error('Server info channel {conf.channel} is not a textable channel!')
+            logging.error(f'Server info channel {channel_id} is not a textable channel!')
 
     except hikari.NotFoundError:
-        logging.error(f'Server info channel {conf.channel} doesn\'t exist.')
+        logging.error(f'Server info channel {channel_id} doesn\'t exist.')
 
     except Exception:
-        logging.error(f'Failed to fetch server info channel {conf.channel}', exc_info=True)
+        logging.error(f'Failed to fetch server info channel {channel_id}', exc_info=True)
 
     return None
 
 
+class ServerBoard():
+    """Server list of one guild, kept up to date in the guild's server info channel."""
+
+    def __init__(self, guild_id: int, conf: ServerBrowserSettings, channel: hikari.TextableChannel | None) -> None:
+        # The main guild keeps the state name from before there were multiple guilds.
+        name: str = 'server_browser' if guild_id == darklight_bot.config.guild else f'server_browser.{guild_id}'
+
+        self.guild_id = guild_id
+        self.conf = conf
+        self.channel = channel
+        self.board: BulletinBoard = BulletinBoard(plugin.bot, darklight_bot.state, name, plugin.bot.d.outbound, PAGES_PER_MESSAGE)
+        self.published: tuple | None = None
+
+    async def publish(self, servers: ServerCollection) -> None:
+        """Updates the channel if anything shown about the guild's servers has changed."""
+        if self.channel is None:
+            return
+
+        guild_servers: list[Server] = servers.select(self.conf)
+        state: tuple = tuple(s.state() for s in guild_servers)
+
+        if state != self.published and await update_server_info_channel(guild_servers, self.board, self.channel):
+            self.published = state
+
+
+async def create_boards(boards: Sequence[ServerBoard] = ()) -> list[ServerBoard]:
+    """Creates boards for all guilds with a server browser, reusing those of `boards` whose channel is the same."""
+    existing: dict[int, ServerBoard] = { b.guild_id: b for b in boards }
+    new_boards: list[ServerBoard] = []
+
+    for guild in darklight_bot.config.guilds:
+        conf: ServerBrowserSettings | None = guild.server_browser
+
+        if conf is None:
+            continue
+
+        board = existing.get(guild.id)
+
+        if board is None or board.conf.channel != conf.channel:
+            board = ServerBoard(guild.id, conf, await fetch_server_info_channel(conf.channel))
+        else:
+            board.conf = conf
+
+        new_boards.append(board)
+
+    return new_boards
+
+
+async def update_server_info_task(bot: lightbulb.BotApp,
+                                  servers: ServerCollection,
+                                  boards: list[ServerBoard]) -> None:
+    """
+    Task responsible for updating server info. Wakes up whenever a server is due to be polled.
+
+    Servers of all guilds are polled together and each guild's board is then
+    updated from the results, so a server shared by several guilds is only
+    queried once.
+    """
+
+    presence_players: int | None = None
+
+    # Show the last known state right away instead of waiting for the first queries.
+    if servers.restore(darklight_bot.state.load('servers')):
+        update_presence_player_count(bot, servers)
+        presence_players = servers.get_total_players()
+
+        await asyncio.gather(*(b.publish(servers) for b in boards))
+
+    while True:
+        await servers.wait()
+
+        try:
+            with diagnostics.span('Server info tick', 'slow_tick'):
+                tick_start: float = time.perf_counter()
+
+                # QUERY SERVERS
+
+                try:
+                    with TICK_PHASE_DURATION.time('query'):
+                        changed: bool = await servers.update()
+                except Exception:
+                    logging.error('Failed to query servers', exc_info=True)
+
+                    # Clear presence if update fails (we don't want to display stale player counts).
+                    set_presence(bot, None)
+
+                    presence_players = None
+                    continue
+
+                # UPDATE INFO (only when something has changed)
+
+                if servers.reconfigured:
+                    servers.reconfigured = False
+                    changed = True
+
+                with TICK_PHASE_DURATION.time('save'):
+                    if servers.history_unsaved:
+                        await servers.save_history()
+
+                    if changed:
+                        try:
+                            await asyncio.to_thread(darklight_bot.state.save, 'servers', servers.snapshot())
+                        except OSError:
+                            logging.warning('Failed to save server snapshot', exc_info=True)
+
+                total_players: int = servers.get_total_players()
+
+                if total_players != presence_players:
+                    update_presence_player_count(bot, servers)
+                    presence_players = total_players
+
+                # Boards whose servers haven't changed (or failed to update last time) are skipped.
+                await asyncio.gather(*(b.publish(servers) for b in boards))
+
+                TICK_DURATION.observe(time.perf_counter() - tick_start)
+        except Exception:
+            logging.error('Server info tick failed', exc_info=True)
+
+
+_update_task: asyncio.Task | None = None
+_servers: ServerCollection | None = None
+_boards: list[ServerBoard] = []
+
+
+def get_guild_servers(guild_id: int) -> list[Server] | None:
+    """Servers shown in a guild, `None` if the guild doesn't have a server browser."""
+    guild = darklight_bot.config.get_guild(guild_id)
+
+    if _servers is None or guild is None or guild.server_browser is None:
+        return None
+
+    return _servers.select(guild.server_browser)
+
+
 @plugin.listener(hikari.StartedEvent)
 async def on_ready(_: hikari.StartedEvent) -> None:
-    conf: ServerBrowserSettings = darklight_bot.config.server_browser
-    servers: ServerCollection = ServerCollection([ Server((s.address, s.query_port), s.name) for s in conf.servers ])
-    board_channel: hikari.TextableChannel | None = await fetch_server_info_channel()
+    global _update_task, _servers
+
+    conf: ServerBrowserSettings | None = darklight_bot.config.polled_servers()
+
+    if conf is None:
+        return
+
+    history: HistoryStore = HistoryStore(os.path.join(darklight_bot.config.state_dir, 'history.bin'))
+    await asyncio.to_thread(history.load)
+
+    server_list: list[Server] = [ Server((s.address, s.query_port), s.name) for s in conf.servers ]
+    servers: ServerCollection
+
+    if darklight_bot.config.query_worker:
+        servers = RemoteServerCollection(server_list, conf, history)
+        servers.start()
+    else:
+        servers = ServerCollection(server_list, conf, history)
+
+    _servers = servers
+    _boards[:] = await create_boards()
+
+    _update_task = asyncio.create_task(update_server_info_task(plugin.bot, servers, _boards))
+    _update_task.add_done_callback(log_task_exit)
+
+
+def log_task_exit(task: asyncio.Task) -> None:
+    """Ticks handle their own errors, this is for anything that still ends the server info task."""
+    if not task.cancelled() and task.exception() is not None:
+        logging.error('Server info task has stopped', exc_info=task.exception())
 
-    @tasks.task(s=conf.query_interval, pass_app=True)
-    async def update_server_info_task(bot: lightbulb.BotApp) -> None:
-        """Task responsible for updating server info."""
 
-        # QUERY SERVERS
+@plugin.listener(ConfigReloadedEvent)
+async def on_config_reloaded(event: ConfigReloadedEvent) -> None:
+    old: ServerBrowserSettings | None = event.old.polled_servers()
+    new: ServerBrowserSettings | None = event.new.polled_servers()
+
+    if _servers is None:
+        if new is not None:
+            logging.warning('Server browser has been enabled, restart the bot to start it')
+        return
+
+    if new != old:
+        _servers.configure(new or dataclasses.replace(_servers.conf, servers=[]))
+
+    # The running task picks up the new boards on its next tick.
+    _boards[:] = await create_boards(_boards)
+    _servers.wakeup.set()
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def on_stopping(_: hikari.StoppingEvent) -> None:
+    if _update_task is not None:
+        _update_task.cancel()
+
+    if _servers is not None:
+        await _servers.save_history()
+        await _servers.close()
+
+
+@lightbulb.command('servers', 'Show the servers and how many players are on them', guilds=darklight_bot.config.guild_ids('server_browser'), ephemeral=True)
+@lightbulb.implements(commands.SlashCommand)
+async def list_servers(ctx: lightbulb.context.Context) -> None:
+    guild_servers: list[Server] | None = get_guild_servers(ctx.guild_id)
+
+    if guild_servers is None or _servers is None:
+        await respond(ctx, 'Server info isn\'t available yet, try again in a moment.')
+        return
+
+    conf: ServerBrowserSettings = darklight_bot.config.get_guild(ctx.guild_id).server_browser
+    stale: list[Server] = _servers.stale(guild_servers, conf.max_staleness)
+
+    if stale:
+        # Everyone asking while the servers are being queried waits for the same queries.
+        await respond(ctx, hikari.ResponseType.DEFERRED_MESSAGE_CREATE)
 
         try:
-            await servers.update()
-        except Exception:
-            logging.error('Failed to query servers', exc_info=True)
+            await asyncio.wait_for(asyncio.shield(_servers.refresh_servers(stale)), REFRESH_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+    pages: list[list[hikari.Embed]] = layout_messages(render_server_list(guild_servers))
+
+    if len(pages) > 1:
+        await respond(ctx, embeds=pages[0], component=server_list_navigation(0, len(pages)))
+    else:
+        await respond(ctx, embeds=pages[0])
 
-            # Clear presence if update fails (we don't want to display stale player counts).
-            try:
-                await bot.update_presence(activity=None)
-            except Exception: 
-                logging.error('Failed to clear bot\'s presence')
-            finally:
-                return
-        
-        # UPDATE INFO
 
-        await update_presence_player_count(bot, servers)
+def server_list_navigation(page: int, page_count: int) -> hikari.api.MessageActionRowBuilder:
+    """Buttons for browsing the pages of a `/servers` response."""
+    row = plugin.bot.rest.build_message_action_row()
 
-        if board_channel:
-            await update_server_info_channel(servers, board_channel)
+    (row.add_button(hikari.ButtonStyle.SECONDARY, f'{SERVERS_PAGE_PREFIX}{page - 1}')
+        .set_label('Previous')
+        .set_is_disabled(page <= 0)
+        .add_to_container())
 
-    update_server_info_task.start()
+    (row.add_button(hikari.ButtonStyle.SECONDARY, f'{SERVERS_PAGE_PREFIX}{page + 1}')
+        .set_label('Next')
+        .set_is_disabled(page >= page_count - 1)
+        .add_to_container())
+
+    return row
+
+
+@plugin.listener(hikari.InteractionCreateEvent)
+async def on_server_list_page(event: hikari.InteractionCreateEvent) -> None:
+    """Shows another page of the server list in a `/servers` response, rendered from the current state."""
+    interaction = event.interaction
+
+    if not isinstance(interaction, hikari.ComponentInteraction) or not interaction.custom_id.startswith(SERVERS_PAGE_PREFIX):
+        return
+
+    guild_servers: list[Server] | None = get_guild_servers(interaction.guild_id) if interaction.guild_id else None
+
+    if guild_servers is None:
+        return
+
+    try:
+        page: int = int(interaction.custom_id[len(SERVERS_PAGE_PREFIX):])
+    except ValueError:
+        return
+
+    pages: list[list[hikari.Embed]] = layout_messages(render_server_list(guild_servers))
+    page = max(0, min(page, len(pages) - 1))
+    component = server_list_navigation(page, len(pages)) if len(pages) > 1 else None
+
+    await plugin.bot.d.outbound.send(('interaction',),
+                                     lambda: interaction.create_initial_response(hikari.ResponseType.MESSAGE_UPDATE,
+                                                                                 embeds=pages[page],
+                                                                                 component=component),
+                                     priority=Priority.INTERACTION)
+
+
+@lightbulb.option('server', 'Server name (all servers if not set)', required=False)
+@lightbulb.command('server-stats', 'Show when the servers are busy', guilds=darklight_bot.config.guild_ids('server_browser'), ephemeral=True)
+@lightbulb.implements(commands.SlashCommand)
+async def server_stats(ctx: lightbulb.context.Context) -> None:
+    guild_servers: list[Server] | None = get_guild_servers(ctx.guild_id)
+
+    if guild_servers is None or _servers is None or _servers.history is None:
+        await respond(ctx, 'Server stats aren\'t available yet, try again in a moment.')
+        return
+
+    query: str | None = ctx.options.server
+    selected: list[Server] = [ s for s in guild_servers if not query or query.lower() in s.name.lower() ]
+
+    if not selected:
+        await respond(ctx, f'There is no server matching `{query}`.')
+        return
+
+    stats = compute_stats([ _servers.history.get(s.key) for s in selected ], time.time())
+    title: str = selected[0].name if len(selected) == 1 else 'All servers'
+    embed = hikari.Embed(title=f'SERVER STATS - {title}', description='Based on the last 4 weeks.')
+
+    if stats.peak_hours:
+        embed.add_field(name='Busiest hours',
+                        value='\n'.join(f'<t:{int(dt.datetime.now(dt.timezone.utc).replace(hour=h, minute=0, second=0, microsecond=0).timestamp())}:t>'
+                                        f' \u2014 `{avg:.1f}` players on average'
+                                        for h, avg in stats.peak_hours))
+    else:
+        embed.add_field(name='Busiest hours', value='Not enough data yet.')
+
+    if stats.previous_week_avg > 0:
+        change: float = (stats.week_avg - stats.previous_week_avg) / stats.previous_week_avg * 100
+        trend: str = f'`{change:+.0f}%` compared to the week before'
+    else:
+        trend = 'Not enough data to compare with the week before.'
+
+    embed.add_field(name='This week',
+                    value=f'**Average**\t`{stats.week_avg:.1f}` players\n**Peak**\t`{stats.week_max}` players\n{trend}')
+
+    await respond(ctx, embed=embed)
+
+
+@lightbulb.option('name', 'Player name (or the beginning of it)')
+@lightbulb.command('whereis', 'Find out which server a player is on', guilds=darklight_bot.config.guild_ids('server_browser'), ephemeral=True)
+@lightbulb.implements(commands.SlashCommand)
+async def whereis(ctx: lightbulb.context.Context) -> None:
+    guild_servers: list[Server] | None = get_guild_servers(ctx.guild_id)
+
+    if guild_servers is None or _servers is None:
+        await respond(ctx, 'Server info isn\'t available yet, try again in a moment.')
+        return
+
+    servers_by_key: dict[str, Server] = { s.key: s for s in guild_servers }
+    matches = _servers.player_index.lookup(ctx.options.name)
+    lines: list[str] = []
+
+    for match in matches:
+        server_names = [ servers_by_key[k].name for k in match.servers if k in servers_by_key ]
+        if server_names:
+            lines.append(f'**{match.name}** is playing on {", ".join(f"`{n}`" for n in server_names)}')
+
+    if lines:
+        await respond(ctx, '\n'.join(lines))
+    else:
+        await respond(ctx, f'Nobody called `{ctx.options.name}` is playing right now.')
 
 
 def load(bot: lightbulb.BotApp) -> None:
     bot.add_plugin(plugin)
 
+    # Commands without any guilds would be registered globally.
+    if darklight_bot.config.guild_ids('server_browser'):
+        bot.command(list_servers)
+        bot.command(server_stats)
+        bot.command(whereis)
+
 
 def unload(bot: lightbulb.BotApp) -> None:
+    for cmd_name in ['servers', 'server-stats', 'whereis']:
+        command = bot.get_slash_command(cmd_name)
+        if command is not None:
+            bot.remove_command(command)
+
     bot.remove_plugin(plugin)
\ No newline at end of file
@@ -1,12 +1,110 @@
+import asyncio
+import hashlib
+import logging
+import re
+from typing import Any, Awaitable, Callable, Hashable, Sequence
+
 import hikari
-from typing import Sequence
+
+from bot.utils.outbound import OutboundScheduler, Priority
+from bot.utils.state import StateStore
+
+
+# Discord timestamp markup (`<t:1670000000:R>`) is left out of fingerprints,
+# otherwise every "Updated ... ago" line would count as a change.
+TIMESTAMP_PATTERN = re.compile(r'<t:-?\d+(?::[tTdDfFR])?>')
+
+# Discord limits
+EMBED_MAX_FIELDS = 25
+EMBED_FIELD_MAX_CHARS = 1024
+EMBED_MAX_CHARS = 6000
+MESSAGE_MAX_EMBEDS = 10
+MESSAGE_MAX_CHARS = 6000
+
+
+def fingerprint(embeds: Sequence[hikari.Embed]) -> str:
+    """Returns a hash of the content of a message's embeds, ignoring timestamps."""
+    content = tuple(
+        (
+            embed.title,
+            TIMESTAMP_PATTERN.sub('', embed.description or ''),
+            embed.url,
+            embed.footer.text if embed.footer else None,
+            tuple((f.name, f.value, f.is_inline) for f in embed.fields)
+        )
+        for embed in embeds
+    )
+    return hashlib.blake2b(repr(content).encode(), digest_size=16).hexdigest()
+
+
+def embed_length(embed: hikari.Embed) -> int:
+    """Number of characters that count towards Discord's embed size limit."""
+    return (len(embed.title or '')
+            + len(embed.description or '')
+            + len(embed.footer.text or '' if embed.footer else '')
+            + len(embed.author.name or '' if embed.author else '')
+            + sum(len(f.name) + len(f.value) for f in embed.fields))
+
+
+def layout_messages(embeds: Sequence[hikari.Embed], per_message: int | None = None) -> list[list[hikari.Embed]]:
+    """
+    Packs embeds, in order, into as few messages as Discord's limits allow.
+
+    With `per_message`, every message holds that many embeds instead, so an
+    embed always lands in the same message however the others change. The
+    caller has to keep them small enough to fit.
+    """
+    if per_message is not None:
+        return [ list(embeds[i:i + per_message]) for i in range(0, len(embeds), per_message) ]
+
+    messages: list[list[hikari.Embed]] = []
+    length = 0
+
+    for embed in embeds:
+        size = embed_length(embed)
+
+        if not messages or len(messages[-1]) >= MESSAGE_MAX_EMBEDS or length + size > MESSAGE_MAX_CHARS:
+            messages.append([])
+            length = 0
+
+        messages[-1].append(embed)
+        length += size
+
+    return messages
+
 
 class BulletinBoard():
-    """A class for publishing embeds into multiple persistent messages and keeping them updated"""
+    """
+    A class for publishing embeds into multiple persistent messages and keeping them updated.
+
+    Embeds are packed into as few messages as possible, or `embeds_per_message`
+    to a message if given (see `layout_messages`).
+    The board remembers its messages and the fingerprints of what they show, so
+    only messages whose content has changed are edited. The channel history is
+    only scanned on the first push or when a remembered message has gone missing.
+
+    When given a `state` store, the board persists its messages and fingerprints
+    under `name`, so after a restart it goes straight to targeted edits.
+
+    When given an `outbound` scheduler, messages are sent and edited through it
+    at board priority, so a newer version of a message replaces a queued edit.
+    """
 
-    def __init__(self, bot: hikari.GatewayBot) -> None:
-        self.embeds: Sequence[hikari.Embed] = []
+    def __init__(self,
+                 bot: hikari.GatewayBot,
+                 state: StateStore | None = None,
+                 name: str = 'bulletin',
+                 outbound: OutboundScheduler | None = None,
+                 embeds_per_message: int | None = None) -> None:
+        self.embeds: list[hikari.Embed] = []
         self.bot = bot
+        self.state = state
+        self.name = name
+        self.outbound = outbound
+        self.embeds_per_message = embeds_per_message
+        self.message_ids: list[hikari.Snowflake] = []
+        self.fingerprints: list[str | None] = []
+        self.saved_state: dict | None = None
 
 
     def add_embed(self, embed: hikari.Embed) -> None:
@@ -14,16 +112,137 @@ class BulletinBoard():
         self.embeds.append(embed)
 
 
-    async def push_to_channel(self, channel: hikari.TextableChannel):
-        """Modifies bot's latest messages with current embeds. New messages are created if necessary."""
-        my_id = self.bot.get_me().id
-        messages = [ x for x in await self.bot.rest.fetch_messages(channel) if x.author.id == my_id ]
-        
-        messages_to_edit = list(reversed(messages[:len(self.embeds)]))
+    def clear(self) -> None:
+        """Removes all embeds from the board (published messages are left as they are)"""
+        self.embeds = []
+
+
+    async def scan_channel(self, channel: hikari.TextableChannel, count: int) -> None:
+        """Finds bot's latest `count` messages in the channel and remembers them as the board's messages."""
+        me = self.bot.get_me()
+
+        if not me:
+            raise RuntimeError('Failed to fetch the bot user')
+
+        messages = [ x for x in await self.bot.rest.fetch_messages(channel) if x.author.id == me.id ]
+        messages = list(reversed(messages[:count]))
+
+        self.message_ids = [ m.id for m in messages ]
+        self.fingerprints = [ fingerprint(m.embeds) for m in messages ]
+
+
+    def restore(self, channel: hikari.TextableChannel) -> bool:
+        """Loads board's messages from the state store. Returns `True` if there were any for the channel."""
+        if self.state is None:
+            return False
+
+        data = self.state.load(self.name)
+
+        if not data or data.get('channel') != int(channel.id):
+            return False
+
+        self.message_ids = [ hikari.Snowflake(x) for x in data.get('message_ids', []) ]
+        self.fingerprints = data.get('fingerprints', [])
+        self.fingerprints += [None] * (len(self.message_ids) - len(self.fingerprints))
+        self.saved_state = data
+
+        return bool(self.message_ids)
+
+
+    async def save(self, channel: hikari.TextableChannel) -> None:
+        """Writes board's messages to the state store if they've changed since the last save."""
+        if self.state is None:
+            return
+
+        data = {
+            'channel': int(channel.id),
+            'message_ids': [ int(x) for x in self.message_ids ],
+            'fingerprints': list(self.fingerprints)
+        }
+
+        if data == self.saved_state:
+            return
+
+        try:
+            await asyncio.to_thread(self.state.save, self.name, data)
+            self.saved_state = data
+        except OSError:
+            logging.warning(f'Failed to save the state of bulletin board "{self.name}"', exc_info=True)
+
+
+    async def push_to_channel(self, channel: hikari.TextableChannel) -> None:
+        """
+        Modifies board's messages whose embeds have changed. New messages are created
+        if necessary and messages that are no longer needed are deleted.
+        """
+        messages = layout_messages(self.embeds, self.embeds_per_message)
+
+        if not self.message_ids and not self.restore(channel):
+            await self.scan_channel(channel, len(messages))
+
+        try:
+            await self._push(channel, messages)
+        except hikari.NotFoundError:
+            logging.info(f'Bulletin board message in channel {channel.id} has gone missing, rescanning the channel')
+            await self.scan_channel(channel, len(messages))
+            await self._push(channel, messages)
+        finally:
+            await self.save(channel)
+
+
+    async def _send(self, route: tuple, action: Callable[[], Awaitable[Any]], key: Hashable | None = None) -> Any:
+        if self.outbound is None:
+            return await action()
+
+        return await self.outbound.send(route, action, key, Priority.BOARD)
+
+
+    async def _edit(self,
+                    channel: hikari.TextableChannel,
+                    idx: int,
+                    embeds: list[hikari.Embed],
+                    message_fingerprint: str) -> None:
+        message_id = self.message_ids[idx]
+        await self._send(('edit_message', int(channel.id)),
+                         lambda: self.bot.rest.edit_message(channel, message_id, content='', embeds=embeds),
+                         key=('message', int(message_id)))
+        self.fingerprints[idx] = message_fingerprint
+
+
+    async def _delete_surplus(self, channel: hikari.TextableChannel, count: int) -> None:
+        """Deletes board's messages past the first `count`."""
+        while len(self.message_ids) > count:
+            message_id = self.message_ids[-1]
+
+            try:
+                await self._send(('delete_message', int(channel.id)),
+                                 lambda: self.bot.rest.delete_message(channel, message_id))
+            except hikari.NotFoundError:
+                pass
+
+            self.message_ids.pop()
+            self.fingerprints.pop()
+
+
+    async def _push(self, channel: hikari.TextableChannel, messages: list[list[hikari.Embed]]) -> None:
+        edits: list[Awaitable[None]] = []
+
+        for idx, embeds in enumerate(messages):
+            message_fingerprint = fingerprint(embeds)
+
+            if idx >= len(self.message_ids):
+                # New messages are sent one by one to keep them in order.
+                message = await self._send(('create_message', int(channel.id)),
+                                           lambda embeds=embeds: channel.send(content='', embeds=embeds))
+                self.message_ids.append(message.id)
+                self.fingerprints.append(message_fingerprint)
+
+            elif self.fingerprints[idx] != message_fingerprint:
+                edits.append(self._edit(channel, idx, embeds, message_fingerprint))
+
+        edits.append(self._delete_surplus(channel, len(messages)))
+        results = await asyncio.gather(*edits, return_exceptions=True)
 
-        for idx, embed in enumerate(self.embeds):
-            if idx >= len(messages_to_edit):
-                await channel.send(content='', embed=embed)
-            else:
-                # WARNING: Hitting rate limiter when there are too many messages to edit!
-                await messages_to_edit[idx].edit(content='', embed=embed)
\ No newline at end of file
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+
+import hikari
+
+import bot as darklight_bot
+from bot.config import Config
+
+
+# Settings that are only read on startup.
+RESTART_REQUIRED = ('state_dir', 'cache_profile', 'query_worker', 'metrics_port', 'diagnostics')
+
+
+class ConfigReloadedEvent(hikari.Event):
+    """
+    Dispatched after the configuration file has been reloaded.
+
+    `bot.config` already holds the new settings by the time listeners are
+    called, `old` and `new` let them apply only what has changed.
+    """
+
+    def __init__(self, app: hikari.RESTAware, old: Config, new: Config) -> None:
+        self._app = app
+        self.old = old
+        self.new = new
+
+    @property
+    def app(self) -> hikari.RESTAware:
+        return self._app
+
+
+_lock: asyncio.Lock = asyncio.Lock()
+
+
+async def reload_config(bot: hikari.GatewayBot) -> Config:
+    """
+    Reloads the configuration file and lets the extensions apply the changes
+    without reconnecting. Raises `ConfigError` (keeping the current settings)
+    if the file is missing or invalid.
+    """
+    async with _lock:
+        new: Config = await asyncio.to_thread(Config.parse, darklight_bot.CONFIG_PATH)
+        old: Config = darklight_bot.config
+
+        for name in RESTART_REQUIRED:
+            if getattr(old, name) != getattr(new, name):
+                logging.warning(f'Config setting "{name}" has changed, restart the bot to apply it')
+                setattr(new, name, getattr(old, name))
+
+        if old.guild_ids() != new.guild_ids():
+            logging.warning('The list of guilds has changed, restart the bot to register commands in new guilds')
+
+        darklight_bot.config = new
+        logging.info('Configuration reloaded')
+
+        await bot.dispatch(ConfigReloadedEvent(bot, old, new))
+
+    return new
@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from types import FrameType
+from typing import Any, Awaitable, Callable, Iterator
+
+from bot.config import DiagnosticsSettings
+from bot.utils import metrics
+
+
+SAMPLE_HISTORY = 60     # seconds of stack samples kept for slow span reports
+REPORTED_STACKS = 3
+REPORTED_FRAMES = 8
+
+LOOP_LAG = metrics.histogram('darklight_event_loop_lag_seconds', 'How late the event loop woke up the lag sentinel')
+
+Frame = tuple[str, int, str]
+
+
+def extract_stack(frame: FrameType | None) -> tuple[Frame, ...]:
+    """Innermost frame first, cheaper than `traceback.extract_stack` as no source lines are read."""
+    stack: list[Frame] = []
+
+    while frame is not None:
+        stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+
+    return tuple(stack)
+
+
+def format_stack(stack: tuple[Frame, ...]) -> str:
+    return '\n'.join(f'    {name} ({filename}:{lineno})' for filename, lineno, name in stack[:REPORTED_FRAMES])
+
+
+class Diagnostics():
+    """
+    Finds out what is holding up the event loop.
+
+    - A sentinel task sleeps for `lag_interval` over and over and measures how
+      late it wakes up. Late wake-ups mean that something blocked the loop.
+    - A watchdog thread notices when the sentinel hasn't run for over
+      `lag_threshold` and logs the stack of the event loop's thread, which is
+      the code blocking it at that moment.
+    - While a timing span (see `span`) is open, the watchdog samples the event
+      loop thread's stack every `sample_interval`. A span that takes longer
+      than its threshold logs the stacks sampled most often during it.
+
+    Nothing here depends on the event loop's implementation, so it works with
+    uvloop as well.
+    """
+
+    def __init__(self, conf: DiagnosticsSettings) -> None:
+        self.conf = conf
+        self.loop_thread_id: int = threading.get_ident()
+        self.heartbeat: float = time.monotonic()
+        self.open_spans: int = 0
+        self.samples: deque[tuple[float, tuple[Frame, ...]]] = deque(maxlen=int(SAMPLE_HISTORY / conf.sample_interval))
+        self.sentinel_task: asyncio.Task | None = None
+        self.watchdog_thread: threading.Thread | None = None
+        self.stopping: threading.Event = threading.Event()
+
+    def start(self) -> None:
+        """Starts the sentinel and the watchdog. Must be called from the event loop's thread."""
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.sentinel_task = asyncio.create_task(self._sentinel())
+        self.watchdog_thread = threading.Thread(target=self._watchdog, name='diagnostics-watchdog', daemon=True)
+        self.watchdog_thread.start()
+
+    def stop(self) -> None:
+        if self.sentinel_task is not None:
+            self.sentinel_task.cancel()
+            self.sentinel_task = None
+
+        self.stopping.set()
+
+    async def _sentinel(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.conf.lag_interval)
+            lag = loop.time() - start - self.conf.lag_interval
+            self.heartbeat = time.monotonic()
+
+            LOOP_LAG.observe(lag)
+
+            if lag > self.conf.lag_threshold:
+                logging.warning(f'Event loop lagged by {lag:.3f}s')
+
+    def _watchdog(self) -> None:
+        reported = False
+
+        while not self.stopping.wait(self.conf.sample_interval):
+            now = time.monotonic()
+            frame = sys._current_frames().get(self.loop_thread_id)
+
+            if self.open_spans:
+                self.samples.append((now, extract_stack(frame)))
+
+            blocked = now - self.heartbeat - self.conf.lag_interval
+
+            # Report every block once, with the stack from when it crossed the threshold.
+            if blocked > self.conf.lag_threshold and not reported:
+                reported = True
+                stack: str = ''.join(traceback.format_stack(frame)) if frame is not None else '(stack not available)'
+                logging.warning(f'Event loop has been blocked for {blocked:.3f}s, it is running:\n{stack}')
+            elif blocked <= self.conf.lag_threshold:
+                reported = False
+
+            del frame
+
+    def report(self, name: str, start: float, end: float) -> None:
+        """Logs the stacks sampled most often between `start` and `end`."""
+        stacks: Counter[tuple[Frame, ...]] = Counter(stack for at, stack in list(self.samples) if start <= at <= end)
+        total = sum(stacks.values())
+        lines: list[str] = [ f'{name} took {end - start:.3f}s' ]
+
+        if total:
+            lines[0] += f', most sampled stacks of the event loop ({total} samples):'
+            for stack, count in stacks.most_common(REPORTED_STACKS):
+                lines.append(f'  {count / total:.0%}\n{format_stack(stack)}')
+
+        logging.warning('\n'.join(lines))
+
+
+_diagnostics: Diagnostics | None = None
+
+
+def enable(conf: DiagnosticsSettings) -> None:
+    global _diagnostics
+
+    if _diagnostics is None:
+        _diagnostics = Diagnostics(conf)
+        _diagnostics.start()
+
+
+def disable() -> None:
+    global _diagnostics
+
+    if _diagnostics is not None:
+        _diagnostics.stop()
+        _diagnostics = None
+
+
+@contextmanager
+def span(name: str, threshold: str) -> Iterator[None]:
+    """
+    Times the `with` block and reports what the event loop was doing if it took
+    longer than the `threshold` setting (e.g. `slow_tick`). Does nothing unless
+    diagnostics are enabled.
+    """
+    diagnostics = _diagnostics
+
+    if diagnostics is None:
+        yield
+        return
+
+    diagnostics.open_spans += 1
+    start = time.monotonic()
+
+    try:
+        yield
+    finally:
+        end = time.monotonic()
+        diagnostics.open_spans -= 1
+
+        if end - start > getattr(diagnostics.conf, threshold):
+            diagnostics.report(name, start, end)
+
+
+def timed_command(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Runs a command callback in a span named after the command."""
+
+    @functools.wraps(func)
+    async def wrapper(ctx, *args: Any, **kwargs: Any) -> Any:
+        with span(f'/{ctx.command.name}', 'slow_command'):
+            return await func(ctx, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,336 @@
+import logging
+import os
+import struct
+import tempfile
+from array import array
+from typing import Iterator, NamedTuple
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+SAMPLE_INTERVAL = 60        # rollups take one sample per minute
+MAX_SAMPLE_GAP = 15 * 60    # longer gaps between polls (e.g. while the bot was down) are left empty
+HOURLY_CAPACITY = 24 * 90   # 90 days
+DAILY_CAPACITY = 5 * 365    # 5 years
+
+MAX_SAMPLE = 0xffff
+FILE_MAGIC = b'DLH1'
+
+
+class Rollup(NamedTuple):
+    period: int
+    min: int
+    max: int
+    total: int
+    count: int
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class RollupSeries():
+    """
+    Fixed-size ring of min/sum/max/count rollups, one per period (hour or day).
+
+    Values are kept in parallel typed arrays, so the memory used is fixed at
+    construction no matter how long the bot runs.
+    """
+
+    _HEADER = struct.Struct('<III')
+    _CURRENT = struct.Struct('<iHHIH')
+
+    def __init__(self, capacity: int, period_length: int) -> None:
+        self.capacity = capacity
+        self.period_length = period_length
+        self.periods = array('i', [0]) * capacity
+        self.mins = array('H', [0]) * capacity
+        self.maxs = array('H', [0]) * capacity
+        self.totals = array('I', [0]) * capacity
+        self.counts = array('H', [0]) * capacity
+        self.head = 0
+        self.size = 0
+        self.current: Rollup | None = None
+
+    def add(self, timestamp: float, value: int) -> Rollup | None:
+        """
+        Adds a sample to the rollup of the period it falls in.
+
+        Returns
+        -------
+        The rollup of the previous period if the sample started a new one.
+        """
+        period = int(timestamp // self.period_length)
+        current = self.current
+
+        if current is not None and current.period == period:
+            self.current = Rollup(period,
+                                  min(current.min, value),
+                                  max(current.max, value),
+                                  current.total + value,
+                                  current.count + 1)
+            return None
+
+        self.current = Rollup(period, value, value, value, 1)
+
+        if current is not None:
+            self.append(current)
+
+        return current
+
+    def append(self, rollup: Rollup) -> None:
+        """Stores a finished rollup, overwriting the oldest one when full."""
+        idx = (self.head + self.size) % self.capacity
+
+        if self.size == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+        else:
+            self.size += 1
+
+        self.periods[idx] = rollup.period
+        self.mins[idx] = min(rollup.min, MAX_SAMPLE)
+        self.maxs[idx] = min(rollup.max, MAX_SAMPLE)
+        self.totals[idx] = min(rollup.total, 0xffffffff)
+        self.counts[idx] = min(rollup.count, MAX_SAMPLE)
+
+    def __iter__(self) -> Iterator[Rollup]:
+        """Finished rollups followed by the one in progress, oldest first."""
+        for i in range(self.size):
+            idx = (self.head + i) % self.capacity
+            yield Rollup(self.periods[idx], self.mins[idx], self.maxs[idx], self.totals[idx], self.counts[idx])
+
+        if self.current is not None:
+            yield self.current
+
+    def since(self, timestamp: float) -> Iterator[Rollup]:
+        """Rollups of periods starting at or after `timestamp`."""
+        first_period = int(timestamp // self.period_length)
+        return (r for r in self if r.period >= first_period)
+
+    def to_bytes(self) -> bytes:
+        current = self.current or Rollup(-1, 0, 0, 0, 0)
+        return b''.join((self._HEADER.pack(self.capacity, self.head, self.size),
+                         self._CURRENT.pack(current.period,
+                                            min(current.min, MAX_SAMPLE),
+                                            min(current.max, MAX_SAMPLE),
+                                            min(current.total, 0xffffffff),
+                                            min(current.count, MAX_SAMPLE)),
+                         self.periods.tobytes(),
+                         self.mins.tobytes(),
+                         self.maxs.tobytes(),
+                         self.totals.tobytes(),
+                         self.counts.tobytes()))
+
+    def from_bytes(self, data: memoryview) -> int:
+        """Loads the series from `data`. Returns the number of bytes read."""
+        capacity, head, size = self._HEADER.unpack_from(data, 0)
+        offset = self._HEADER.size
+        current = Rollup(*self._CURRENT.unpack_from(data, offset))
+        offset += self._CURRENT.size
+
+        series: list[array] = []
+        for typecode in ('i', 'H', 'H', 'I', 'H'):
+            values = array(typecode)
+            end = offset + capacity * values.itemsize
+            values.frombytes(data[offset:end])
+            series.append(values)
+            offset = end
+
+        # Replay the stored rollups, so a changed capacity is handled gracefully.
+        stored = RollupSeries(capacity, self.period_length)
+        stored.periods, stored.mins, stored.maxs, stored.totals, stored.counts = series
+        stored.head, stored.size = head, size
+
+        for rollup in stored:
+            self.append(rollup)
+
+        self.current = current if current.count else None
+
+        return offset
+
+
+class ServerHistory():
+    """
+    Player count history of one server as hourly and daily rollups.
+
+    Servers are polled more often while they're busy, so polls are resampled
+    to one sample per `SAMPLE_INTERVAL` before they're rolled up: every
+    interval gets the last player count polled in it, or the one before it if
+    the server wasn't polled. That way averages are weighted by time rather
+    than by how often the server happened to be polled.
+    """
+
+    def __init__(self) -> None:
+        self.hourly = RollupSeries(HOURLY_CAPACITY, HOUR)
+        self.daily = RollupSeries(DAILY_CAPACITY, DAY)
+        self.slot: int | None = None
+        self.players: int = 0
+
+    def record(self, timestamp: float, players: int) -> bool:
+        """Records a polled player count. Returns `True` if an hour has been rolled up."""
+        players = max(0, min(players, MAX_SAMPLE))
+        slot = int(timestamp // SAMPLE_INTERVAL)
+        rolled_up = False
+
+        if self.slot is not None and slot > self.slot:
+            rolled_up |= self._add(self.slot, self.players)
+
+            # Hold the previous count over the intervals without a poll.
+            for held in range(max(self.slot + 1, slot - MAX_SAMPLE_GAP // SAMPLE_INTERVAL), slot):
+                rolled_up |= self._add(held, self.players)
+
+        if self.slot is None or slot >= self.slot:
+            self.slot = slot
+            self.players = players
+
+        return rolled_up
+
+    def _add(self, slot: int, players: int) -> bool:
+        timestamp = slot * SAMPLE_INTERVAL
+        self.daily.add(timestamp, players)
+        return self.hourly.add(timestamp, players) is not None
+
+    def to_bytes(self) -> bytes:
+        return self.hourly.to_bytes() + self.daily.to_bytes()
+
+    def from_bytes(self, data: memoryview) -> None:
+        offset = self.hourly.from_bytes(data)
+        self.daily.from_bytes(data[offset:])
+
+
+class HistoryStore():
+    """
+    Player count histories of all servers, persisted to a single binary file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.servers: dict[str, ServerHistory] = {}
+
+    def get(self, key: str) -> ServerHistory:
+        history = self.servers.get(key)
+
+        if history is None:
+            history = self.servers[key] = ServerHistory()
+
+        return history
+
+    def record(self, key: str, timestamp: float, players: int) -> bool:
+        """Records a sample for a server. Returns `True` if an hour has been rolled up (a good time to save)."""
+        return self.get(key).record(timestamp, players)
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'rb') as f:
+                data = memoryview(f.read())
+        except FileNotFoundError:
+            return
+        except OSError:
+            logging.warning('Failed to read player history', exc_info=True)
+            return
+
+        try:
+            if bytes(data[:4]) != FILE_MAGIC:
+                raise ValueError('Unknown file format')
+
+            offset = 4
+            while offset < len(data):
+                key_length, data_length = struct.unpack_from('<HI', data, offset)
+                offset += 6
+                key = str(data[offset:offset + key_length], 'utf-8')
+                offset += key_length
+                self.get(key).from_bytes(data[offset:offset + data_length])
+                offset += data_length
+        except (ValueError, struct.error):
+            logging.warning('Player history file is corrupt, starting over', exc_info=True)
+            self.servers.clear()
+
+    def save(self) -> None:
+        """Atomically writes all histories to the file."""
+        chunks: list[bytes] = [FILE_MAGIC]
+
+        for key, history in self.servers.items():
+            encoded_key = key.encode('utf-8')
+            encoded_history = history.to_bytes()
+            chunks.append(struct.pack('<HI', len(encoded_key), len(encoded_history)))
+            chunks.append(encoded_key)
+            chunks.append(encoded_history)
+
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b''.join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class Stats(NamedTuple):
+    peak_hours: list[tuple[int, float]]
+    week_avg: float
+    previous_week_avg: float
+    week_max: int
+
+
+def compute_stats(histories: list[ServerHistory], now: float, days: int = 28) -> Stats:
+    """
+    Computes stats for the combined player count of `histories` from their rollups.
+
+    Returns
+    -------
+    Busiest hours of the day (UTC) over the last `days` days with their average
+    player count, this and last week's average and this week's peak.
+    """
+
+    # Average total players for each hour of the day. Totals are summed across
+    # servers per period first, so they reflect concurrent players.
+    hourly_totals: dict[int, float] = {}
+    for history in histories:
+        for rollup in history.hourly.since(now - days * DAY):
+            hourly_totals[rollup.period] = hourly_totals.get(rollup.period, 0.0) + rollup.avg
+
+    by_hour_sum = [0.0] * 24
+    by_hour_count = [0] * 24
+    for period, avg in hourly_totals.items():
+        hour = period % 24
+        by_hour_sum[hour] += avg
+        by_hour_count[hour] += 1
+
+    by_hour = [ (h, by_hour_sum[h] / by_hour_count[h]) for h in range(24) if by_hour_count[h] ]
+    peak_hours = sorted(by_hour, key=lambda x: x[1], reverse=True)[:3]
+
+    def daily_totals(first_day: int, last_day: int) -> dict[int, tuple[float, int]]:
+        totals: dict[int, tuple[float, int]] = {}
+        for history in histories:
+            for rollup in history.daily.since(first_day * DAY):
+                if rollup.period > last_day:
+                    continue
+                avg, peak = totals.get(rollup.period, (0.0, 0))
+                totals[rollup.period] = (avg + rollup.avg, peak + rollup.max)
+        return totals
+
+    # Peaks of several servers are summed per day, which is an upper bound of
+    # the combined peak since the servers may have peaked at different times.
+    # Weeks are the last 7 (UTC) days including today and the 7 days before.
+    today = int(now // DAY)
+    this_week = daily_totals(today - 6, today)
+    previous_week = daily_totals(today - 13, today - 7)
+
+    def mean(values: list[float]) -> float:
+        return sum(values) / len(values) if values else 0.0
+
+    return Stats(peak_hours=peak_hours,
+                 week_avg=mean([ v[0] for v in this_week.values() ]),
+                 previous_week_avg=mean([ v[0] for v in previous_week.values() ]),
+                 week_max=max((v[1] for v in this_week.values()), default=0))
@@ -0,0 +1,258 @@
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Hashable
+
+import hikari
+import lightbulb
+
+from bot.utils import metrics
+
+
+class Priority(IntEnum):
+    """Order in which queued updates are sent (lower goes first)."""
+
+    INTERACTION = 0
+    ROLES = 1
+    PRESENCE = 2
+    BOARD = 3
+
+
+# Requests per period (in seconds) allowed for each kind of route. A route is a
+# tuple starting with one of these names, followed by the IDs Discord keys its
+# rate limit buckets on (usually the channel or the guild).
+ROUTE_LIMITS: dict[str, tuple[int, float]] = {
+    'interaction': (50, 1.0),
+    'create_message': (5, 5.0),
+    'edit_message': (5, 5.0),
+    'edit_member': (10, 10.0),
+    'presence': (5, 60.0),
+}
+DEFAULT_ROUTE_LIMIT = (5, 5.0)
+
+REQUESTS = metrics.counter('darklight_rest_requests_total', 'REST and gateway updates sent by route and outcome (ok, rate_limited or error)', ('route', 'result'))
+REQUEST_DURATION = metrics.histogram('darklight_rest_request_seconds', 'Time it took to send an update by route', ('route',))
+THROTTLED = metrics.counter('darklight_rest_throttled_total', 'Updates held back by the route\'s token bucket', ('route',))
+
+
+class TokenBucket():
+    """Allows `capacity` requests per `period` seconds, refilled continuously."""
+
+    def __init__(self, capacity: int, period: float) -> None:
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """Time until a token is available."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job():
+    __slots__ = ('route', 'key', 'action', 'priority', 'futures', 'dispatched', 'throttled')
+
+    def __init__(self, route: tuple, key: Hashable | None, action: Callable[[], Awaitable[Any]], priority: int) -> None:
+        self.route = route
+        self.key = key
+        self.action = action
+        self.priority = priority
+        self.futures: list[asyncio.Future] = []
+        self.dispatched = False
+        self.throttled = False
+
+
+class OutboundScheduler():
+    """
+    Sends REST and gateway updates on behalf of the whole bot.
+
+    - Every route has its own token bucket, so updates are paced below
+      Discord's rate limits instead of running into them.
+    - Updates submitted with a `key` coalesce: a queued update is replaced by a
+      newer one with the same key (latest wins) and all submitters get the
+      result of the update that was actually sent.
+    - Queued updates are sent in `Priority` order and at most `max_in_flight`
+      at a time. Interaction responses are exempt from that cap, so they never
+      wait for slow (e.g. rate limited) board refreshes to finish.
+    """
+
+    def __init__(self, max_in_flight: int = 4) -> None:
+        self.max_in_flight = max_in_flight
+        self.queue: list[tuple[int, int, _Job]] = []
+        self.queued: dict[Hashable, _Job] = {}
+        self.in_flight_keys: set[Hashable] = set()
+        self.in_flight: int = 0
+        self.buckets: dict[tuple, TokenBucket] = {}
+        self.sequence = itertools.count()
+        self.wakeup: asyncio.Event | None = None
+        self.worker: asyncio.Task | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    def submit(self,
+               route: tuple,
+               action: Callable[[], Awaitable[Any]],
+               key: Hashable | None = None,
+               priority: int = Priority.BOARD) -> asyncio.Future:
+        """
+        Queues `action` to be called on `route`.
+
+        Returns
+        -------
+        Future with the result of the action (or of a newer action with the same `key` that replaced it).
+        """
+        future = asyncio.get_running_loop().create_future()
+        job = self.queued.get(key) if key is not None else None
+
+        if job is None:
+            job = _Job(route, key, action, priority)
+            if key is not None:
+                self.queued[key] = job
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+        else:
+            job.action = action
+            job.route = route
+
+            # Move the job up if the newer update is more urgent.
+            if priority < job.priority:
+                job.priority = priority
+                heapq.heappush(self.queue, (priority, next(self.sequence), job))
+
+        job.futures.append(future)
+        self._ensure_worker()
+        self.wakeup.set()
+
+        return future
+
+    async def send(self,
+                   route: tuple,
+                   action: Callable[[], Awaitable[Any]],
+                   key: Hashable | None = None,
+                   priority: int = Priority.BOARD) -> Any:
+        """Submits `action` and waits for its result."""
+        return await self.submit(route, action, key, priority)
+
+    def _ensure_worker(self) -> None:
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self._run())
+
+    def _bucket(self, route: tuple) -> TokenBucket:
+        bucket = self.buckets.get(route)
+
+        if bucket is None:
+            bucket = self.buckets[route] = TokenBucket(*ROUTE_LIMITS.get(route[0], DEFAULT_ROUTE_LIMIT))
+
+        return bucket
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self.wakeup.clear()
+            now = loop.time()
+            timeout: float | None = None
+            deferred: list[tuple[int, int, _Job]] = []
+
+            while self.queue and (self.in_flight < self.max_in_flight or self.queue[0][0] == Priority.INTERACTION):
+                entry = heapq.heappop(self.queue)
+                job = entry[2]
+
+                if job.dispatched:
+                    continue
+
+                # Keep updates with the same key in order.
+                if job.key is not None and job.key in self.in_flight_keys:
+                    deferred.append(entry)
+                    continue
+
+                bucket = self._bucket(job.route)
+                delay = bucket.delay(now)
+
+                if delay > 0:
+                    if not job.throttled:
+                        job.throttled = True
+                        THROTTLED.inc(job.route[0])
+
+                    deferred.append(entry)
+                    timeout = delay if timeout is None else min(timeout, delay)
+                    continue
+
+                bucket.take(now)
+                self._dispatch(job)
+
+            for entry in deferred:
+                heapq.heappush(self.queue, entry)
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, job: _Job) -> None:
+        job.dispatched = True
+        self.in_flight += 1
+
+        if job.key is not None:
+            del self.queued[job.key]
+            self.in_flight_keys.add(job.key)
+
+        task = asyncio.create_task(self._execute(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _execute(self, job: _Job) -> None:
+        route: str = job.route[0]
+        start = time.perf_counter()
+
+        try:
+            result = await job.action()
+        except Exception as e:
+            REQUESTS.inc(route, 'rate_limited' if isinstance(e, (hikari.RateLimitedError, hikari.RateLimitTooLongError)) else 'error')
+
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            REQUESTS.inc(route, 'ok')
+
+            for future in job.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            REQUEST_DURATION.observe(time.perf_counter() - start, route)
+            self.in_flight -= 1
+            if job.key is not None:
+                self.in_flight_keys.discard(job.key)
+            self.wakeup.set()
+
+    async def close(self) -> None:
+        """Stops sending. Queued updates are dropped."""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+        for _, _, job in self.queue:
+            for future in job.futures:
+                if not future.done():
+                    future.cancel()
+
+        self.queue.clear()
+        self.queued.clear()
+
+
+async def respond(ctx: lightbulb.context.Context, *args: Any, **kwargs: Any) -> Any:
+    """Responds to a command through the bot's outbound scheduler, ahead of any queued background updates."""
+    return await ctx.bot.d.outbound.send(('interaction',),
+                                         lambda: ctx.respond(*args, **kwargs),
+                                         priority=Priority.INTERACTION)
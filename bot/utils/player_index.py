@@ -0,0 +1,139 @@
+import bisect
+import unicodedata
+from typing import Iterable, NamedTuple
+
+
+FUZZY_THRESHOLD = 0.2
+
+
+def normalize(name: str) -> str:
+    """Folds case, accents and whitespace so lookups match names the way people type them."""
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
+
+
+def trigrams(name: str) -> set[str]:
+    padded = f'  {name} '
+    return { padded[i:i + 3] for i in range(len(padded) - 2) }
+
+
+class Match(NamedTuple):
+    name: str
+    servers: list[str]
+
+
+class PlayerIndex():
+    """
+    Inverted index from normalized player name to the servers the player is on.
+
+    The index is updated incrementally from the difference between consecutive
+    player lists of a server. Exact lookups are a dictionary hit, prefix
+    lookups a binary search over the sorted names and fuzzy lookups only score
+    names that share a trigram with the query.
+    """
+
+    def __init__(self) -> None:
+        # normalized name -> server key -> name as displayed in game
+        self.names: dict[str, dict[str, str]] = {}
+        # server key -> normalized names of players on it
+        self.servers: dict[str, set[str]] = {}
+        self.sorted_names: list[str] = []
+        self.trigrams: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _add(self, key: str, server: str, name: str) -> None:
+        entry = self.names.get(key)
+
+        if entry is None:
+            entry = self.names[key] = {}
+            bisect.insort(self.sorted_names, key)
+            for trigram in trigrams(key):
+                self.trigrams.setdefault(trigram, set()).add(key)
+
+        entry[server] = name
+
+    def _remove(self, key: str, server: str) -> None:
+        entry = self.names.get(key)
+
+        if entry is None:
+            return
+
+        entry.pop(server, None)
+
+        if not entry:
+            del self.names[key]
+            del self.sorted_names[bisect.bisect_left(self.sorted_names, key)]
+            for trigram in trigrams(key):
+                keys = self.trigrams.get(trigram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.trigrams[trigram]
+
+    def update_server(self, server: str, names: Iterable[str]) -> None:
+        """Replaces the player list of a server, touching only players who joined or left."""
+        current: dict[str, str] = { normalize(n): n for n in names if n.strip() }
+        previous: set[str] = self.servers.get(server, set())
+
+        for key in previous - current.keys():
+            self._remove(key, server)
+
+        for key, name in current.items():
+            if key not in previous or self.names[key].get(server) != name:
+                self._add(key, server, name)
+
+        if current:
+            self.servers[server] = set(current)
+        else:
+            self.servers.pop(server, None)
+
+    def remove_server(self, server: str) -> None:
+        self.update_server(server, ())
+
+    def _match(self, key: str) -> Match:
+        entry = self.names[key]
+        return Match(next(iter(entry.values())), list(entry))
+
+    def lookup(self, query: str, limit: int = 10) -> list[Match]:
+        """
+        Finds players by name: an exact match if there is one, otherwise names
+        starting with `query`, otherwise names similar to `query`.
+        """
+        key = normalize(query)
+
+        if not key:
+            return []
+
+        if key in self.names:
+            return [self._match(key)]
+
+        matches: list[Match] = []
+        idx = bisect.bisect_left(self.sorted_names, key)
+
+        while idx < len(self.sorted_names) and len(matches) < limit and self.sorted_names[idx].startswith(key):
+            matches.append(self._match(self.sorted_names[idx]))
+            idx += 1
+
+        if matches:
+            return matches
+
+        # Score names sharing at least one trigram with the query by trigram similarity.
+        query_trigrams = trigrams(key)
+        shared: dict[str, int] = {}
+
+        for trigram in query_trigrams:
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        scored = []
+        for candidate, count in shared.items():
+            score = count / (len(query_trigrams) + len(candidate) + 1 - count)
+            if score >= FUZZY_THRESHOLD:
+                scored.append((score, candidate))
+
+        scored.sort(reverse=True)
+
+        return [ self._match(candidate) for _, candidate in scored[:limit] ]
@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from typing import Any, Iterable, Sequence
+
+from dacite.core import from_dict
+
+from bot.config import ServerBrowserSettings
+from bot.utils.history import HistoryStore
+from bot.utils.server_list import Server, ServerCollection
+
+
+RESTART_DELAY = 5
+MAX_LINE_LENGTH = 1 << 24
+
+
+class QueryWorkerError(Exception):
+    """Query worker failed to poll the servers"""
+    pass
+
+
+class RemoteServerCollection(ServerCollection):
+    """
+    Server collection polled by a query worker process (see `run_worker`).
+
+    The worker is sent the settings of the polled servers whenever they change
+    (and the servers to poll right away when they are refreshed) and answers
+    every round of queries with a JSON line listing the servers it has polled,
+    the state of those that have changed and their new player lists. The
+    collection only applies these updates, so querying and parsing never hold
+    up the bot's event loop. A worker that exits is restarted.
+    """
+
+    def __init__(self, servers: Sequence[Server], conf: ServerBrowserSettings, history: HistoryStore | None = None):
+        super().__init__(servers, conf, history)
+        self.process: asyncio.subprocess.Process | None = None
+        self.task: asyncio.Task | None = None
+        self.updates: deque[dict] = deque()
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._serve()
+            except Exception:
+                logging.error('Query worker failed', exc_info=True)
+
+            logging.warning(f'Query worker has exited, restarting it in {RESTART_DELAY} seconds')
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def _serve(self) -> None:
+        self.process = await asyncio.create_subprocess_exec(sys.executable, '-m', 'bot.utils.query_worker',
+                                                            stdin=asyncio.subprocess.PIPE,
+                                                            stdout=asyncio.subprocess.PIPE,
+                                                            limit=MAX_LINE_LENGTH)
+        logging.info(f'Started query worker (pid {self.process.pid})')
+
+        try:
+            self._send_settings()
+
+            while line := await self.process.stdout.readline():
+                self.updates.append(json.loads(line))
+                self.wakeup.set()
+        finally:
+            if self.process.returncode is None:
+                with contextlib.suppress(ProcessLookupError):
+                    self.process.terminate()
+
+            await self.process.wait()
+
+    def _send(self, message: dict[str, Any]) -> None:
+        if self.process is not None and self.process.returncode is None:
+            self.process.stdin.write(json.dumps(message).encode() + b'\n')
+
+    def _send_settings(self) -> None:
+        self._send({ 'settings': dataclasses.asdict(self.conf) })
+
+    def configure(self, conf: ServerBrowserSettings) -> None:
+        super().configure(conf)
+        self._send_settings()
+
+    def refresh_servers(self, servers: Iterable[Server]) -> asyncio.Future:
+        servers = [ s for s in servers if s not in self.refresh_pending ]
+
+        if servers:
+            self._send({ 'poll': [ s.key for s in servers ] })
+
+        return super().refresh_servers(servers)
+
+    async def wait(self) -> None:
+        """Sleeps until the worker sends an update, or until the server list has been reconfigured."""
+        if not self.updates:
+            await self.wakeup.wait()
+
+        self.wakeup.clear()
+
+    async def update(self) -> bool:
+        """
+        Applies the updates received from the worker since the last call.
+
+        Returns
+        -------
+        `True` if any of the polled servers has changed.
+        """
+        changed = False
+        self.polled = []
+
+        while self.updates:
+            update = self.updates.popleft()
+
+            if 'error' in update:
+                raise QueryWorkerError(update['error'])
+
+            changed |= self.apply_update(update)
+
+        self.complete_refresh()
+
+        return changed
+
+    def apply_update(self, update: dict) -> bool:
+        servers: dict[str, Server] = { s.key: s for s in self.servers }
+        changed = False
+        now = time.time()
+        loop_time = asyncio.get_running_loop().time()
+
+        # Servers may have been removed from the config since the worker polled them.
+        for key, state in update['changed'].items():
+            if key in servers:
+                servers[key].restore(state)
+                changed = True
+
+        for key, names in update['players'].items():
+            if key in servers:
+                self.player_index.update_server(key, names)
+
+        for key in update['polled']:
+            server = servers.get(key)
+
+            if server is not None:
+                server.polled_at = loop_time
+                self.polled.append(server)
+
+                if self.history is not None:
+                    self.history_unsaved |= self.history.record(key, now, server.players)
+
+        return changed
+
+
+def write_message(message: dict[str, Any]) -> None:
+    sys.stdout.write(json.dumps(message, separators=(',', ':')) + '\n')
+    sys.stdout.flush()
+
+
+async def poll_servers(servers: ServerCollection) -> None:
+    """Polls the servers and writes what has changed since the last update to stdout."""
+    sent_states: dict[str, tuple] = {}
+    sent_players: dict[str, list[str]] = {}
+
+    while True:
+        await servers.wait()
+
+        try:
+            await servers.update()
+        except Exception as e:
+            logging.error('Failed to query servers', exc_info=True)
+            write_message({ 'error': str(e) or type(e).__name__ })
+            continue
+
+        if not servers.polled:
+            continue
+
+        changed: dict[str, tuple] = {}
+        players: dict[str, list[str]] = {}
+
+        for server in servers.polled:
+            state = server.state()
+            if sent_states.get(server.key) != state:
+                changed[server.key] = sent_states[server.key] = state
+
+            names = server.player_names()
+            if names is not None and sent_players.get(server.key) != names:
+                players[server.key] = sent_players[server.key] = names
+
+        write_message({ 'polled': [ s.key for s in servers.polled ], 'changed': changed, 'players': players })
+
+
+async def run_worker() -> None:
+    """
+    Polls servers until stdin is closed. Every line on stdin either has the
+    settings of the servers to poll or a list of servers to poll right away.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_LINE_LENGTH)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    servers: ServerCollection | None = None
+    poll_task: asyncio.Task | None = None
+
+    try:
+        while line := await reader.readline():
+            message: dict = json.loads(line)
+
+            if 'poll' in message:
+                if servers is not None:
+                    keys: set[str] = set(message['poll'])
+                    servers.refresh_servers(s for s in servers if s.key in keys)
+                continue
+
+            conf: ServerBrowserSettings = from_dict(data_class=ServerBrowserSettings, data=message['settings'])
+
+            if servers is None:
+                servers = ServerCollection([ Server((s.address, s.query_port), s.name) for s in conf.servers ], conf)
+                poll_task = asyncio.create_task(poll_servers(servers))
+            else:
+                servers.configure(conf)
+    finally:
+        if poll_task is not None:
+            poll_task.cancel()
+
+        if servers is not None:
+            await servers.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s query_worker: %(message)s')
+
+    if os.name != 'nt':
+        import uvloop
+        uvloop.install()
+
+    # The bot stops the worker along with itself.
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(run_worker())
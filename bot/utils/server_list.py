@@ -0,0 +1,370 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from typing import Iterable, Iterator, Sequence
+
+from bot.config import ServerBrowserSettings
+from bot.utils import unreal_query
+from bot.utils.history import HistoryStore
+from bot.utils.player_index import PlayerIndex
+
+
+OFFLINE_AFTER_FAILURES = 3
+COALESCE_WINDOW = 1.0
+SNAPSHOT_MAX_AGE = 300
+
+
+class Server():
+    def __init__(self, addr: tuple[str, int], default_name: str) -> None:
+        self.name = default_name
+        self.addr = addr
+        self.info: unreal_query.ServerInfo | None = None
+        self.players: int = 0
+        self.max_players: int = 0
+        self.map: str = ''
+        self.failed_updates: int = 0
+        self.is_online: bool = False
+        self.latency: unreal_query.RttEstimator = unreal_query.RttEstimator()
+        self.next_poll: float = 0.0
+        self.polled_at: float = -math.inf
+
+    @property
+    def key(self) -> str:
+        return f'{self.addr[0]}:{self.addr[1]}'
+
+    def state(self) -> tuple:
+        """Everything that is displayed about the server."""
+        return (self.name, self.map, self.players, self.max_players, self.is_online)
+
+    def restore(self, state: Sequence) -> None:
+        """Restores what's displayed about the server from a snapshot of `state()`."""
+        self.name, self.map, self.players, self.max_players, self.is_online = state
+
+    def player_names(self) -> list[str] | None:
+        """Names of the players on the server, `None` if they aren't known (the last query failed)."""
+        if self.info is not None:
+            return [ p.name for p in self.info.player_list ] if self.players else []
+
+        return None if self.is_online else []
+
+    def is_circuit_open(self, conf: ServerBrowserSettings) -> bool:
+        """Server has failed so many times in a row that it's only probed occasionally."""
+        return self.failed_updates >= conf.circuit_breaker_threshold
+
+    def query_estimator(self, conf: ServerBrowserSettings) -> unreal_query.RttEstimator | None:
+        """
+        Timeouts and retries for the next query. Servers that are down get `None`,
+        a single probe with the default timeout instead of the retries backed off
+        to the longest timeout by their failures.
+        """
+        if self.failed_updates >= OFFLINE_AFTER_FAILURES or self.is_circuit_open(conf):
+            return None
+
+        return self.latency
+
+    def poll_interval(self, conf: ServerBrowserSettings) -> float:
+        """Time until the server should be queried again, based on its last known state."""
+        if self.failed_updates == 0:
+            return conf.query_interval if self.players > 0 else max(conf.idle_interval, conf.query_interval)
+
+        if self.failed_updates < OFFLINE_AFTER_FAILURES:
+            # Confirm quickly whether the server is really down.
+            return conf.query_interval
+
+        if self.is_circuit_open(conf):
+            return conf.max_backoff
+
+        backoff = conf.query_interval * 2 ** (self.failed_updates - OFFLINE_AFTER_FAILURES + 1)
+        return min(backoff, conf.max_backoff)
+
+    def apply(self, info: unreal_query.ServerInfo | None) -> bool:
+        """
+        Updates the server state from a query result (`None` if the query failed).
+
+        Returns
+        -------
+        `True` if anything displayed about the server has changed.
+        """
+        old_state = self.state()
+        self.info = info
+
+        if self.info:
+            self.name = self.info.name
+            self.map = self.info.map
+            self.players = self.info.players
+            self.max_players = self.info.max_players
+            self.failed_updates = 0
+            self.is_online = True
+        else:
+            self.failed_updates += 1
+
+            if self.failed_updates >= OFFLINE_AFTER_FAILURES:
+                self.is_online = False
+                self.players = 0
+            else:
+                self.map = 'Refreshing...'
+
+        return self.state() != old_state
+
+
+class ServerCollection():
+    """
+    Game servers along with their polling schedule.
+
+    Servers are kept in a heap keyed by the time of their next poll. Busy
+    servers are polled every `query_interval`, empty ones every `idle_interval`
+    and offline ones with exponential backoff up to `max_backoff`. Offline
+    servers only get a single probe (no retries), so a dead server doesn't hold
+    up the servers polled along with it. After `circuit_breaker_threshold`
+    failures in a row the circuit opens and the server is only probed every
+    `max_backoff`.
+    """
+
+    def __init__(self, servers: Sequence[Server], conf: ServerBrowserSettings, history: HistoryStore | None = None):
+        self.servers: list[Server] = list(servers)
+        self.by_addr: dict[tuple[str, int], Server] = { s.addr: s for s in self.servers }
+        self.conf = conf
+        self.reconfigured: bool = False
+        self.wakeup: asyncio.Event = asyncio.Event()
+        self.history = history
+        self.history_unsaved: bool = False
+        self.player_index: PlayerIndex = PlayerIndex()
+        self.polled: list[Server] = []
+        self.refresh: asyncio.Future | None = None
+        self.refresh_pending: set[Server] = set()
+        self.schedule: list[tuple[float, int, Server]] = []
+        self.sequence = itertools.count()
+
+        now = asyncio.get_event_loop().time()
+        for s in self.servers:
+            self.reschedule(s, now)
+
+    def __iter__(self) -> Iterator[Server]:
+        for s in self.servers:
+            yield s
+
+    def __bool__(self) -> bool:
+        return any(True for _ in self.servers)
+
+    def get(self, addr: tuple[str, int]) -> Server | None:
+        return self.by_addr.get(addr)
+
+    def select(self, conf: ServerBrowserSettings) -> list[Server]:
+        """Servers configured in `conf` (e.g. of one guild), in their configured order."""
+        servers = (self.by_addr.get((s.address, s.query_port)) for s in conf.servers)
+        return [ s for s in servers if s is not None ]
+
+    def get_total_players(self) -> int:
+        return sum([ s.players for s in self.servers])
+
+    def snapshot(self) -> dict:
+        """Returns the state of all servers to be saved between restarts."""
+        return {
+            'saved_at': time.time(),
+            'servers': { s.key: s.state() for s in self.servers }
+        }
+
+    def restore(self, snapshot: dict | None, max_age: float = SNAPSHOT_MAX_AGE) -> bool:
+        """Restores server state from a snapshot unless it's older than `max_age` seconds."""
+        if not snapshot or time.time() - snapshot.get('saved_at', 0) > max_age:
+            return False
+
+        states: dict = snapshot.get('servers', {})
+        restored = False
+
+        for server in self.servers:
+            if server.key in states:
+                server.restore(states[server.key])
+                restored = True
+
+        return restored
+
+    def reschedule(self, server: Server, when: float) -> None:
+        server.next_poll = when
+        heapq.heappush(self.schedule, (when, next(self.sequence), server))
+
+    def configure(self, conf: ServerBrowserSettings) -> None:
+        """
+        Applies new settings: servers that are no longer configured are dropped,
+        new ones are polled right away and the rest keep their state, but are
+        rescheduled in case their poll interval has become shorter.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        current: dict[tuple[str, int], Server] = { s.addr: s for s in self.servers }
+        servers: list[Server] = []
+
+        self.conf = conf
+
+        for server_conf in conf.servers:
+            addr = (server_conf.address, server_conf.query_port)
+            server = current.pop(addr, None)
+
+            if server is None:
+                server = Server(addr, server_conf.name)
+                self.reschedule(server, now)
+                logging.info(f'Added server {server.key} to the server list')
+            elif server.next_poll > now + server.poll_interval(conf):
+                self.reschedule(server, now + server.poll_interval(conf))
+
+            servers.append(server)
+
+        for server in current.values():
+            self.player_index.remove_server(server.key)
+            logging.info(f'Removed server {server.key} from the server list')
+
+        self.servers = servers
+        self.by_addr = { s.addr: s for s in servers }
+        self.reconfigured = True
+        self.refresh_pending.intersection_update(servers)
+        self.complete_refresh()
+        self.wakeup.set()
+
+    def next_due(self) -> float:
+        """Loop time at which the next server is due to be polled."""
+        while self.schedule:
+            when, _, server = self.schedule[0]
+
+            # Drop stale entries.
+            if when == server.next_poll and self.by_addr.get(server.addr) is server:
+                return when
+
+            heapq.heappop(self.schedule)
+
+        return math.inf
+
+    def pop_due(self, now: float) -> list[Server]:
+        """Takes all servers due by `now` (plus a short window, so polls are batched) off the schedule."""
+        due: list[Server] = []
+
+        while self.next_due() <= now + COALESCE_WINDOW:
+            _, _, server = heapq.heappop(self.schedule)
+            due.append(server)
+
+        return due
+
+    def stale(self, servers: Iterable[Server], max_age: float) -> list[Server]:
+        """
+        Online servers among `servers` that haven't been polled for over `max_age` seconds.
+        Offline servers are left to their backoff.
+        """
+        deadline: float = asyncio.get_running_loop().time() - max_age
+        return [ s for s in servers if s.is_online and s.polled_at < deadline ]
+
+    def refresh_servers(self, servers: Iterable[Server]) -> asyncio.Future:
+        """
+        Polls `servers` as soon as possible. Requests made while a refresh is
+        pending share its round of queries instead of querying on their own.
+
+        Returns
+        -------
+        Future that is done once all the servers of pending requests have been polled.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        if self.refresh is None or self.refresh.done():
+            self.refresh = loop.create_future()
+
+        for server in servers:
+            if server in self.refresh_pending:
+                continue
+
+            self.refresh_pending.add(server)
+
+            # Servers that are due (or being polled) already will do.
+            if server.next_poll > now:
+                self.reschedule(server, now)
+
+        self.wakeup.set()
+
+        return self.refresh
+
+    def complete_refresh(self) -> None:
+        """Resolves the pending refresh once all of its servers have been polled."""
+        self.refresh_pending.difference_update(self.polled)
+
+        if not self.refresh_pending and self.refresh is not None and not self.refresh.done():
+            self.refresh.set_result(None)
+
+    async def wait(self) -> None:
+        """Sleeps until the next server is due to be polled, or until the server list has been reconfigured."""
+        delay: float = self.next_due() - asyncio.get_running_loop().time() if self else self.conf.query_interval
+
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), max(delay, 0))
+        except asyncio.TimeoutError:
+            pass
+
+        self.wakeup.clear()
+
+    async def update(self) -> bool:
+        """
+        Polls servers that are due and schedules their next poll. The servers
+        that have been polled are left in `polled`.
+
+        Returns
+        -------
+        `True` if any of the polled servers has changed.
+        """
+        loop = asyncio.get_running_loop()
+        due = self.pop_due(loop.time())
+        self.polled = []
+
+        if not due:
+            return False
+
+        try:
+            infos = await unreal_query.get(*[ s.addr for s in due ],
+                                           players=True,
+                                           estimators=[ s.query_estimator(self.conf) for s in due ])
+        except Exception:
+            # Keep the servers on the schedule.
+            for server in due:
+                self.reschedule(server, loop.time() + self.conf.query_interval)
+            raise
+
+        now = loop.time()
+        changed = False
+
+        for server, info in zip(due, infos):
+            # The server may have been removed from the config while it was being polled.
+            if self.by_addr.get(server.addr) is not server:
+                continue
+
+            changed |= server.apply(info)
+            server.polled_at = now
+            self.polled.append(server)
+            self.reschedule(server, now + server.poll_interval(self.conf))
+            self.update_player_index(server)
+
+            if self.history is not None:
+                # Save whenever an hour gets rolled up, it's all that's persisted.
+                self.history_unsaved |= self.history.record(server.key, time.time(), server.players)
+
+        self.complete_refresh()
+
+        return changed
+
+    def update_player_index(self, server: Server) -> None:
+        names: list[str] | None = server.player_names()
+
+        if names is not None:
+            self.player_index.update_server(server.key, names)
+
+    async def close(self) -> None:
+        """Stops polling the servers."""
+        unreal_query.close()
+
+    async def save_history(self) -> None:
+        if self.history is None:
+            return
+
+        try:
+            await asyncio.to_thread(self.history.save)
+            self.history_unsaved = False
+        except OSError:
+            logging.warning('Failed to save player history', exc_info=True)
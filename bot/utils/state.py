@@ -0,0 +1,50 @@
+import json
+import logging
+import os
+import tempfile
+from typing import Any
+
+
+class StateStore():
+    """
+    Small JSON documents kept in a local directory so the bot can pick up where it left off after a restart.
+
+    Documents are written to a temporary file and moved into place, so a crash
+    mid-write never leaves a corrupt document behind.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.json')
+
+    def load(self, name: str) -> Any | None:
+        """Returns the stored document or `None` if it doesn't exist or can't be read."""
+        try:
+            with open(self._file(name), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logging.warning(f'Failed to read state "{name}"', exc_info=True)
+            return None
+
+    def save(self, name: str, data: Any) -> None:
+        """Atomically replaces the stored document."""
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=f'.{name}.', suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmp_path, self._file(name))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
@@ -1,74 +1,615 @@
 import asyncio
-import netstruct
+import ipaddress
+import logging
+import math
+import socket
+import struct
 
-from typing import Iterable
+from enum import IntEnum
+from functools import cached_property
+from typing import Iterable, Iterator, NamedTuple, Sequence
 
+from bot.utils import metrics
 
-PAYLOAD = b"\x80\x00\x00\x00\x00"
 
+HEADER = b"\x80\x00\x00\x00"
+HEADER_SIZE = len(HEADER) + 1
+TIMEOUT = 0.5
+MIN_TIMEOUT = 0.05
+MAX_TIMEOUT = 2.0
+MAX_RETRIES = 2
+RETRY_BUDGET = 4.0
+REASSEMBLY_GAP = 0.05
+RECEIVE_BUFFER_SIZE = 1 << 20
+RESOLVE_TTL = 300.0     # seconds a resolved hostname is used before it's looked up again
+RESOLVE_RETRY = 30.0    # seconds before a failed lookup is retried
 
-class QueryProtocol(asyncio.Protocol):
-    def __init__(self, message, on_con_lost) -> None:
-        self.message = message
-        self.on_con_lost = on_con_lost
-        self.transport = None
-        self.data = b''
+
+QUERIES = metrics.counter('darklight_server_queries_total', 'Game server queries by outcome (ok, timeout, malformed or unresolved)', ('server', 'result'))
+QUERY_RETRIES = metrics.counter('darklight_server_query_retries_total', 'Game server query attempts after the first one', ('server',))
+QUERY_RTT = metrics.histogram('darklight_server_query_rtt_seconds', 'Round trip time of answered game server queries', ('server',))
+
+
+class QueryType(IntEnum):
+    """Query types of the UT2004 query protocol, sent after the packet header."""
+
+    INFO = 0x00
+    RULES = 0x01
+    PLAYERS = 0x02
+
+
+PAYLOAD = HEADER + bytes([QueryType.INFO])
+PAYLOADS: dict[int, bytes] = { t: HEADER + bytes([t]) for t in QueryType }
+
+# Types whose replies may be split across several datagrams.
+MULTI_PACKET_TYPES = frozenset((QueryType.RULES, QueryType.PLAYERS))
+
+
+class QueryError(Exception):
+    """Reply couldn't be parsed"""
+    pass
+
+
+class Reply(NamedTuple):
+    datagrams: dict[int, list[bytes]]
+    rtt: float
+
+
+class RttEstimator:
+    """
+    Per-server round trip time estimate used to pick query timeouts.
+
+    Follows the TCP retransmission timer (RFC 6298): a smoothed RTT and its mean
+    deviation are updated from every answered first attempt, the timeout is
+    backed off on loss and only samples from non-retried probes are used (Karn's algorithm).
+
+    Attributes
+    ----------
+        srtt : Smoothed round trip time in seconds (`None` until the first sample).
+        rttvar : Round trip time variation in seconds.
+        timeout : Current timeout for the first attempt of a query.
+        last_rtt : Most recent round trip time sample.
+        samples : Number of RTT samples taken.
+        losses : Number of query attempts that timed out.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self,
+                 initial_timeout: float = TIMEOUT,
+                 min_timeout: float = MIN_TIMEOUT,
+                 max_timeout: float = MAX_TIMEOUT,
+                 max_retries: int = MAX_RETRIES,
+                 retry_budget: float = RETRY_BUDGET) -> None:
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.srtt: float | None = None
+        self.rttvar: float = 0.0
+        self.timeout: float = initial_timeout
+        self.last_rtt: float | None = None
+        self.samples: int = 0
+        self.losses: int = 0
+
+    def sample(self, rtt: float) -> None:
+        """Updates the estimate with a measured round trip time."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+        self.last_rtt = rtt
+        self.samples += 1
+        self.timeout = min(max(self.srtt + self.K * self.rttvar, self.min_timeout), self.max_timeout)
+
+    def backoff(self) -> None:
+        """Doubles the timeout after a lost query. It's kept until the next valid sample."""
+        self.losses += 1
+        self.timeout = min(self.timeout * 2, self.max_timeout)
+
+    def attempts(self) -> Iterator[float]:
+        """
+        Yields timeouts for successive attempts of one query.
+
+        Every retry doubles the timeout. Retries stop after `max_retries` or once
+        the next attempt would exceed `retry_budget` of total waiting time.
+        """
+        timeout = self.timeout
+        waited = 0.0
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0 and waited + timeout > self.retry_budget:
+                return
+
+            yield timeout
+            waited += timeout
+            timeout = min(timeout * 2, self.max_timeout)
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+
+    return True
+
+
+class _PendingQuery:
+    """Datagrams collected so far for a query to one server, shared by `waiters` concurrent queries."""
+
+    __slots__ = ('future', 'types', 'datagrams', 'timer', 'sent_at', 'rtt', 'waiters')
+
+    def __init__(self, future: asyncio.Future, types: set[int], sent_at: float) -> None:
+        self.future = future
+        self.types = types
+        self.datagrams: dict[int, list[bytes]] = {}
+        self.timer: asyncio.TimerHandle | None = None
+        self.sent_at = sent_at
+        self.rtt: float = 0.0
+        self.waiters: int = 0
+
+    def resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(Reply(self.datagrams, self.rtt))
+
+    def cancel_timer(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+class QueryEngine(asyncio.DatagramProtocol):
+    """
+    Sends all queries from a single bound UDP socket and routes replies back to
+    the waiting futures by the sender's (address, port).
+    """
+
+    def __init__(self) -> None:
+        self.transport: asyncio.DatagramTransport | None = None
+        self.pending: dict[tuple[str, int], _PendingQuery] = {}
 
     def connection_made(self, transport) -> None:
         self.transport = transport
-        self.transport.sendto(self.message)
+
+        # Replies to a whole tick arrive in a burst, make room for them in the kernel buffer.
+        sock: socket.socket | None = transport.get_extra_info('socket')
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            except OSError:
+                pass
 
     def datagram_received(self, data, addr) -> None:
-        self.data = data
-        self.transport.close()
+        pending = self.pending.get(addr[:2])
+
+        if pending is None or pending.future.done() or len(data) < HEADER_SIZE:
+            return
+
+        query_type = data[4]
+        pending.datagrams.setdefault(query_type, []).append(data)
+
+        if QueryType.INFO not in pending.datagrams:
+            return
+
+        if query_type == QueryType.INFO:
+            pending.rtt = asyncio.get_running_loop().time() - pending.sent_at
+
+        if pending.types.isdisjoint(MULTI_PACKET_TYPES):
+            pending.resolve()
+        else:
+            # There is no fragment count in the protocol, so the reply is
+            # considered complete once the server goes quiet for a moment.
+            pending.cancel_timer()
+            pending.timer = asyncio.get_running_loop().call_later(REASSEMBLY_GAP, pending.resolve)
 
     def error_received(self, exc) -> None:
-        print('Error received:', exc)
+        logging.warning(f'Query socket error: {exc}')
 
     def connection_lost(self, exc) -> None:
+        self.transport = None
+
+        for pending in self.pending.values():
+            pending.cancel_timer()
+            if not pending.future.done():
+                pending.future.set_exception(ConnectionError('Query socket closed'))
+
+    @property
+    def is_open(self) -> bool:
+        return self.transport is not None and not self.transport.is_closing()
+
+    async def query(self,
+                    addr: tuple[str, int],
+                    types: Iterable[int] = (QueryType.INFO,),
+                    timeout: float = TIMEOUT) -> Reply | None:
+        """
+        Sends queries of the given `types` to `addr` and waits for the replies.
+
+        Replies are matched by their sender, so `addr` has to be an IP address
+        (see `Resolver` for hostnames), a hostname would never get an answer.
+
+        Returns
+        -------
+        Received datagrams grouped by query type along with the round trip time of the info query
+        or `None` if the server didn't answer the info query in time.
+        """
+
+        if not self.is_open:
+            raise ConnectionError('Query socket is not open')
+
+        if not is_ip_address(addr[0]):
+            raise ValueError(f'{addr[0]} is not an IP address')
+
+        types = { QueryType.INFO, *types }
+        pending = self.pending.get(addr)
+
+        # Concurrent queries to the same server share probes.
+        if pending is None or pending.future.done():
+            loop = asyncio.get_running_loop()
+            pending = _PendingQuery(loop.create_future(), set(), loop.time())
+            self.pending[addr] = pending
+
+        for query_type in types - pending.types:
+            pending.types.add(query_type)
+            self.transport.sendto(PAYLOADS[query_type], addr)
+
+        pending.waiters += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(pending.future), timeout)
+        except asyncio.TimeoutError:
+            # Whatever arrived of a multi-packet reply is still worth returning.
+            return Reply(pending.datagrams, pending.rtt) if QueryType.INFO in pending.datagrams else None
+        finally:
+            pending.waiters -= 1
+
+            # Late replies to an expired probe are dropped by `datagram_received`.
+            # The probe is kept until the last of the queries sharing it gives up.
+            if pending.waiters == 0 and self.pending.get(addr) is pending:
+                pending.cancel_timer()
+                del self.pending[addr]
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+
+class _Resolved:
+    """Cached lookup of a hostname, `addr` is `None` if it has never resolved."""
+
+    __slots__ = ('addr', 'expires')
+
+    def __init__(self, addr: tuple[str, int] | None, expires: float) -> None:
+        self.addr = addr
+        self.expires = expires
+
+
+class Resolver:
+    """
+    Resolves server hostnames to IP addresses without a lookup on every query.
+
+    Lookups are cached for `ttl` seconds. An expired entry is still returned
+    while it's looked up again in the background, and if that lookup fails the
+    last good address is kept and retried after `retry` seconds. IP addresses
+    are cached as they are.
+    """
+
+    def __init__(self, ttl: float = RESOLVE_TTL, retry: float = RESOLVE_RETRY) -> None:
+        self.ttl = ttl
+        self.retry = retry
+        self.cache: dict[tuple[str, int], _Resolved] = {}
+        self.lookups: dict[tuple[str, int], asyncio.Task] = {}
+
+    async def resolve(self, addr: tuple[str, int]) -> tuple[str, int] | None:
+        """Returns the IP address of `addr` or `None` if its hostname couldn't be resolved."""
+        entry = self.cache.get(addr)
+
+        if entry is None and is_ip_address(addr[0]):
+            self.cache[addr] = entry = _Resolved(addr, math.inf)
+
+        if entry is not None and entry.addr is not None:
+            if asyncio.get_running_loop().time() >= entry.expires:
+                self._lookup(addr)
+            return entry.addr
+
+        if entry is not None and asyncio.get_running_loop().time() < entry.expires:
+            return None
+
+        # Nothing to fall back on, wait for the lookup (shared with concurrent queries).
+        return await asyncio.shield(self._lookup(addr))
+
+    def _lookup(self, addr: tuple[str, int]) -> asyncio.Task:
+        task = self.lookups.get(addr)
+
+        if task is None:
+            task = self.lookups[addr] = asyncio.create_task(self._refresh(addr))
+
+        return task
+
+    async def _refresh(self, addr: tuple[str, int]) -> tuple[str, int] | None:
+        loop = asyncio.get_running_loop()
+        entry = self.cache.get(addr)
+
+        try:
+            infos = await loop.getaddrinfo(addr[0], addr[1], family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            resolved: tuple[str, int] = infos[0][4][:2]
+        except (OSError, IndexError) as e:
+            if entry is not None and entry.addr is not None:
+                logging.warning(f'Could not resolve {addr[0]} ({e}), using its last address {entry.addr[0]}')
+            else:
+                logging.warning(f'Could not resolve {addr[0]} ({e})')
+
+            if entry is None:
+                entry = self.cache[addr] = _Resolved(None, 0)
+            entry.expires = loop.time() + self.retry
+        else:
+            if entry is not None and entry.addr is not None and entry.addr != resolved:
+                logging.info(f'{addr[0]} now resolves to {resolved[0]}')
+
+            entry = self.cache[addr] = _Resolved(resolved, loop.time() + self.ttl)
+        finally:
+            del self.lookups[addr]
+
+        return entry.addr
+
+    def close(self) -> None:
+        """Cancels lookups in progress, resolved addresses are kept."""
+        for task in self.lookups.values():
+            task.cancel()
+
+
+resolver = Resolver()
+
+_engine: QueryEngine | None = None
+_engine_lock: asyncio.Lock | None = None
+
+
+async def get_engine() -> QueryEngine:
+    """Returns the shared query engine, opening its socket on first use."""
+    global _engine, _engine_lock
+
+    if _engine is not None and _engine.is_open:
+        return _engine
+
+    if _engine_lock is None:
+        _engine_lock = asyncio.Lock()
+
+    async with _engine_lock:
+        if _engine is None or not _engine.is_open:
+            loop = asyncio.get_running_loop()
+            _, _engine = await loop.create_datagram_endpoint(QueryEngine,
+                                                             local_addr=('0.0.0.0', 0),
+                                                             family=socket.AF_INET)
+
+    return _engine
+
+
+def close() -> None:
+    """Closes the shared query socket."""
+    global _engine
+
+    resolver.close()
+
+    if _engine is not None:
+        _engine.close()
+        _engine = None
+
+
+# PARSING
+#
+# Replies are parsed in place over `memoryview`s of the received datagrams with
+# precompiled structs. Strings are length-prefixed: the length byte counts the
+# trailing null, and when its high bit is set the string is UTF-16 encoded and
+# the remaining bits count characters instead of bytes.
+
+_INT32 = struct.Struct('<i')
+_INT32_X2 = struct.Struct('<ii')
+_PLAYER_STATS = struct.Struct('<iii')
+
+
+class Player(NamedTuple):
+    id: int
+    name: str
+    ping: int
+    score: int
+    stats_id: int
+
+
+def _read_string(view: memoryview, offset: int) -> tuple[str, int]:
+    length = view[offset]
+    offset += 1
+
+    if length & 0x80:
+        end = offset + (length & 0x7f) * 2
+        encoding = 'utf-16-le'
+    else:
+        end = offset + length
+        encoding = 'latin-1'
+
+    if end > len(view):
+        raise QueryError('String runs past the end of the packet')
+
+    return str(view[offset:end], encoding).rstrip('\x00'), end
+
+
+def _strip_colors(text: str) -> str:
+    """Removes `ESC R G B` color codes from a string."""
+    while (idx := text.find('\x1b')) != -1:
+        text = text[:idx] + text[idx + 4:]
+    return text
+
+
+def parse_players(datagrams: Sequence[bytes]) -> list[Player]:
+    players: list[Player] = []
+    append = players.append
+    unpack_stats = _PLAYER_STATS.unpack_from
+    unpack_int = _INT32.unpack_from
+
+    for data in datagrams:
+        view = memoryview(data)
+        end = len(view)
+        offset = HEADER_SIZE
+
+        try:
+            while offset < end:
+                (player_id,) = unpack_int(view, offset)
+                name, offset = _read_string(view, offset + 4)
+                ping, score, stats_id = unpack_stats(view, offset)
+                offset += _PLAYER_STATS.size
+                append(Player(player_id, _strip_colors(name), ping, score, stats_id))
+        except (struct.error, IndexError, QueryError):
+            logging.debug('Truncated player list packet', exc_info=True)
+
+    return players
+
+
+def parse_rules(datagrams: Sequence[bytes]) -> dict[str, str]:
+    rules: dict[str, str] = {}
+
+    for data in datagrams:
+        view = memoryview(data)
+        end = len(view)
+        offset = HEADER_SIZE
+
         try:
-            self.on_con_lost.set_result(True)
-        except asyncio.exceptions.InvalidStateError:
-            pass
+            while offset < end:
+                key, offset = _read_string(view, offset)
+                value, offset = _read_string(view, offset)
+                rules[key] = value
+        except (IndexError, QueryError):
+            logging.debug('Truncated rules packet', exc_info=True)
+
+    return rules
 
 
 class ServerInfo:
-    def __init__(self, addr: tuple[str, int], query_data):
+    """
+    Decoded query reply.
+
+    The basic info is decoded on construction, rules and player lists are only
+    decoded when first accessed.
+    """
+
+    def __init__(self,
+                 addr: tuple[str, int],
+                 query_data: bytes,
+                 rules_data: Sequence[bytes] = (),
+                 players_data: Sequence[bytes] = ()):
         self.addr = addr
         self.query_data = query_data
-        self.data = []
+        self.rules_data = rules_data
+        self.players_data = players_data
+        self.server_id = 0
+        self.ip = ''
+        self.game_port = 0
+        self.query_port = 0
         self.name = ''
         self.map = ''
+        self.game_type = ''
         self.players = 0
         self.max_players = 0
 
         if len(query_data) > 0:
-            self.data = netstruct.unpack(b'<ciciiib$b$b$ii', query_data)
-            self.name = ' '.join(self.data[6].decode('latin-1').split())[:-1]
-            self.map = self.data[7].decode('latin-1').replace('\xc2\xa0', ' ')[:-1]
-            self.players = self.data[9]
-            self.max_players = self.data[10]
+            try:
+                view = memoryview(query_data)
+                (self.server_id,) = _INT32.unpack_from(view, HEADER_SIZE)
+                self.ip, offset = _read_string(view, HEADER_SIZE + 4)
+                self.game_port, self.query_port = _INT32_X2.unpack_from(view, offset)
+                name, offset = _read_string(view, offset + _INT32_X2.size)
+                map, offset = _read_string(view, offset)
+                self.game_type, offset = _read_string(view, offset)
+                self.players, self.max_players = _INT32_X2.unpack_from(view, offset)
+            except (struct.error, IndexError) as e:
+                raise QueryError('Truncated server info packet') from e
+
+            self.name = ' '.join(_strip_colors(name).split())
+            self.map = map.replace('\xc2\xa0', ' ')
+
+    @cached_property
+    def player_list(self) -> list[Player]:
+        return parse_players(self.players_data)
+
+    @cached_property
+    def rules(self) -> dict[str, str]:
+        return parse_rules(self.rules_data)
+
+
+async def query(addr: tuple[str, int],
+                players: bool = False,
+                rules: bool = False,
+                estimator: RttEstimator | None = None) -> ServerInfo | None:
+    """
+    Queries a server. Player list and rules are only requested if asked for.
+
+    Timeouts and retries are taken from `estimator`, which is updated with the outcome.
+    Without one, a single attempt with the default timeout is made.
+    """
+    types: list[QueryType] = []
 
+    if players:
+        types.append(QueryType.PLAYERS)
+    if rules:
+        types.append(QueryType.RULES)
 
-async def query(addr: tuple[str, int]) -> ServerInfo | None:
-    loop = asyncio.get_event_loop()
-    on_con_lost = loop.create_future()
+    engine = await get_engine()
+    reply: Reply | None = None
+    server: str = f'{addr[0]}:{addr[1]}'
 
-    transport, protocol = await loop.create_datagram_endpoint(
-        lambda: QueryProtocol(PAYLOAD, on_con_lost),
-        remote_addr=addr)
+    # Replies come from the resolved address, so that's what the probes are keyed by.
+    target = await resolver.resolve(addr)
+
+    if target is None:
+        QUERIES.inc(server, 'unresolved')
+        return None
+
+    if estimator is None:
+        reply = await engine.query(target, types)
+    else:
+        for attempt, timeout in enumerate(estimator.attempts()):
+            if attempt > 0:
+                QUERY_RETRIES.inc(server)
+
+            reply = await engine.query(target, types, timeout)
+
+            if reply is not None:
+                if attempt == 0:
+                    estimator.sample(reply.rtt)
+                break
+
+            estimator.backoff()
+
+    if not reply:
+        QUERIES.inc(server, 'timeout')
+        return None
+
+    QUERY_RTT.observe(reply.rtt, server)
+    datagrams = reply.datagrams
 
     try:
-        await asyncio.wait_for(on_con_lost, 0.2)
-    except asyncio.TimeoutError:
-        pass
-    finally:
-        transport.close()
+        info = ServerInfo(addr,
+                          datagrams[QueryType.INFO][0],
+                          datagrams.get(QueryType.RULES, ()),
+                          datagrams.get(QueryType.PLAYERS, ()))
+    except QueryError:
+        QUERIES.inc(server, 'malformed')
+        logging.warning(f'Malformed reply from {server}', exc_info=True)
+        return None
+
+    QUERIES.inc(server, 'ok')
+    return info
 
-    if protocol.data:
-        return ServerInfo(addr, protocol.data)
 
+async def get(*args: tuple[str, int],
+              players: bool = False,
+              rules: bool = False,
+              estimators: Sequence[RttEstimator | None] | None = None) -> Iterable[ServerInfo | None]:
+    if estimators is None:
+        estimators = [None] * len(args)
 
-async def get(*args: tuple[str, int]) -> Iterable[ServerInfo | None]:
-    queryTasks = [query(addr) for addr in args]
+    queryTasks = [query(addr, players, rules, estimator) for addr, estimator in zip(args, estimators)]
     return await asyncio.gather(*queryTasks)